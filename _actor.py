@@ -21,6 +21,7 @@ import collections
 
 # from gstasks import setup_ctx_obj, real_add
 import functools
+import io
 import logging
 
 # import heartbeat_time
@@ -36,7 +37,10 @@ import pandas as pd
 import pymongo
 
 import common
+import common.money
 import common.simple_math_eval
+import common.sleep
+import common.time_report
 from common import date_to_grid, spl
 
 MockClickContext = collections.namedtuple("MockClickContext", "obj", defaults=[{}])
@@ -45,45 +49,41 @@ MockClickContext = collections.namedtuple("MockClickContext", "obj", defaults=[{
 async def add_money(
     text: str, send_message_cb: typing.Callable = None, mongo_client=None
 ):
+    """
+    /money amount #category #tag %date comment -- one record per line
+    /money import <csv> -- see `common.money.iter_money_csv`
+    /money report [%Y-%m] -- monthly totals, from `alex.money_rollups`
+    """
     assert send_message_cb is not None
     assert mongo_client is not None
-    amount, *other = re.split(r" +", text)
-    amount = common.simple_math_eval.simple_math_eval(amount)
-    assert amount != 0, "amount==0"
-    tags = set()
-    date = datetime.now()
-    category = None
-    for i, x in enumerate(other):
-        if x.startswith("#"):
-            x = x[1:]
-            if x in ["food", "fun"]:
-                category = x
-            else:
-                tags.add(x)
-        elif x.startswith("%"):
-            x = x[1:]
-            if len(x) == 12:
-                date = datetime.strptime(x, "%Y%m%d%H%M")
-            elif len(x) == 6:
-                date = datetime.strptime(x, "%d%H%M")
-                now = datetime.now()
-                date = date.replace(**{k: getattr(now, k) for k in spl("year,month,")})
-        else:
-            break
-    i += 1
-    comment = " ".join(other[i:])
-    assert category is not None, "no category"
-    mongo_client[common.MONGO_COLL_NAME]["alex.money"].insert_one(
-        {
-            "date": common.to_utc_datetime(date),
-            "comment": comment,
-            "tags": sorted(list(tags)),
-            "category": category,
-            "amount": amount,
-        }
-    )
+    if text.startswith("report"):
+        month = text.removeprefix("report").strip()
+        await send_message_cb(
+            common.money.get_money_report(mongo_client, month if month else None)
+        )
+        return
+
+    categories = common.money.get_money_categories(mongo_client)
+    if text.startswith("import"):
+        res = common.money.insert_money_records(
+            common.money.iter_money_csv(
+                io.StringIO(text.removeprefix("import").strip()), categories
+            ),
+            mongo_client,
+        )
+        await send_message_cb(
+            f"imported {res['inserted']} records ({res['total']-res['inserted']} duplicates)"
+        )
+        return
+
+    records = common.money.parse_money_text(text, categories)
+    assert len(records) > 0, "no records"
+    res = common.money.insert_money_records(records, mongo_client, is_dedup=False)
     await send_message_cb(
-        f"added amount {amount} to category {category} on {date.strftime('%Y-%m-%d %H:%M')}"
+        "\n".join(
+            f"added amount {r.amount} to category {r.category} on {r.date.strftime('%Y-%m-%d %H:%M')}"
+            for r in res["records"]
+        )
     )
 
 
@@ -107,15 +107,20 @@ _SLEEP_CATS = ["sleeping", "social"]
 
 async def sleepend(_, send_message_cb=None, mongo_client=None):
     mongo_coll = mongo_client[common.MONGO_COLL_NAME]["alex.sleepingtimes"]
-    last_record = mongo_coll.find_one(sort=[("startsleep", pymongo.DESCENDING)])
-    cat = last_record["category"]
-    if common.get_sleeping_state(mongo_client) is None:
-        send_message_cb("not sleeping")
+    state = common.update_current_state(
+        mongo_client,
+        {"$set": {"sleeping": None}},
+        condition={"sleeping": {"$ne": None}},
+    )
+    if state is None:
+        await send_message_cb("not sleeping")
         return
-    _now = datetime.now()
+    cat, startsleep = state["sleeping"]["category"], state["sleeping"]["startsleep"]
+    endsleep = common.to_utc_datetime()
+    duration = endsleep - startsleep
     mongo_coll.update_one(
-        {"startsleep": last_record["startsleep"]},
-        {"$set": {"endsleep": common.to_utc_datetime(_now)}},
+        {"startsleep": startsleep},
+        {"$set": {"endsleep": endsleep, "duration_sec": duration.total_seconds()}},
     )
 
     # FIXME
@@ -124,7 +129,7 @@ async def sleepend(_, send_message_cb=None, mongo_client=None):
     # ).sanitize_mongo(cat)
 
     await send_message_cb(
-        f"end sleeping \"{cat}\" (was sleeping {(_now-timedelta(hours=9))-last_record['startsleep']})"
+        f'end sleeping "{cat}" (was sleeping {timedelta(seconds=round(duration.total_seconds()))})'
     )
 
 
@@ -218,27 +223,63 @@ async def sleepend(_, send_message_cb=None, mongo_client=None):
 #     send_message_cb("; ".join(msgs))
 
 
+async def sleep_stats(text, send_message_cb=None, mongo_client=None):
+    """
+    /sleep stats [range] -- range is e.g. `30d` or `4w`
+    """
+    subcommand, *rest = text.split() if text.strip() else ["stats"]
+    assert subcommand == "stats", f"unknown subcommand `{subcommand}`"
+    since = common.to_utc_datetime() - common.sleep.parse_stats_range(
+        rest[0] if rest else None
+    )
+    await send_message_cb(
+        common.sleep.format_sleep_stats(
+            common.sleep.get_sleep_stats(mongo_client, since)
+        )
+    )
+
+
 async def sleepstart(cat, send_message_cb=None, mongo_client=None):
+    state = common.get_current_state(mongo_client)
     if cat not in _SLEEP_CATS:
         await send_message_cb(f"cat \"{cat}\" not in \"{','.join(_SLEEP_CATS)}\"")
         return
-    elif common.get_sleeping_state(mongo_client) is not None:
+    elif state["sleeping"] is not None:
         await send_message_cb(f"already sleeping!")
         return
     elif (
-        mongo_client[common.MONGO_COLL_NAME]["alex.time"]
-        .find_one(sort=[("date", pymongo.DESCENDING)])
-        .get("category", None)
-        is None
+        state["last_time_slot"] is not None
+        and state["last_time_slot"]["category"] is None
     ):
         await send_message_cb(f"waiting for time reply!")
         return
 
+    startsleep = common.to_utc_datetime()
+    if (
+        common.update_current_state(
+            mongo_client,
+            {"$set": {"sleeping": {"category": cat, "startsleep": startsleep}}},
+            condition={"sleeping": None},
+        )
+        is None
+    ):
+        await send_message_cb(f"already sleeping!")
+        return
     mongo_coll = mongo_client[common.MONGO_COLL_NAME]["alex.sleepingtimes"]
-    mongo_coll.insert_one({"category": cat, "startsleep": common.to_utc_datetime()})
+    mongo_coll.insert_one({"category": cat, "startsleep": startsleep})
     await send_message_cb(f'start sleeping "{cat}"')
 
 
+async def time_report(text, send_message_cb=None, mongo_client=None):
+    """
+    /time report [days]
+    """
+    subcommand, *rest = text.split() if text.strip() else ["report"]
+    assert subcommand == "report", f"unknown subcommand `{subcommand}`"
+    days = int(rest[0]) if rest else 7
+    await send_message_cb(common.time_report.get_time_report(mongo_client, days=days))
+
+
 async def add_note(content, send_message_cb=None, mongo_client=None):
     logging.info(f"content: {content}")
     assert len(content) > 0
@@ -17,8 +17,10 @@ ORGANIZATION:
     REVISION: ---
 
 ==============================================================================="""
+import asyncio
 import collections
 import functools
+import io
 import logging
 
 # import heartbeat_time
@@ -27,7 +29,9 @@ import random
 import re
 import string
 import subprocess
+import time
 import typing
+import uuid
 from datetime import datetime, timedelta
 
 import pandas as pd
@@ -38,6 +42,7 @@ from alex_leontiev_toolbox_python.utils.logging_helpers import (
 from alex_leontiev_toolbox_python.utils.logging_helpers import make_log_format
 
 import common
+import common.money
 import common.simple_math_eval
 from common.call_cloud_run import call_cloud_run as __call_cloud_run__
 from _gstasks import real_add, setup_ctx_obj, real_edit
@@ -51,17 +56,119 @@ get_configured_logger = functools.partial(
 MockClickContext = collections.namedtuple("MockClickContext", "obj", defaults=[{}])
 
 
+_CALL_CLOUD_RUN_CONFIG_COLL = "20260102-call-cloud-run-config"
+_CALL_CLOUD_RUN_JOBS_COLL = "20260102-call-cloud-run-jobs"
+# per-function `timeout_sec` in config overrides it; jobs running past their
+# `deadline` (e.g. because the instance died) are stale
+_CALL_CLOUD_RUN_TIMEOUT_SEC = float(os.environ.get("CALL_CLOUD_RUN_TIMEOUT_SEC", "900"))
+# keep references to running jobs, otherwise asyncio may garbage-collect them
+_CALL_CLOUD_RUN_TASKS: typing.Set[asyncio.Task] = set()
+
+
+def _get_call_cloud_run_deadline(job: dict) -> datetime:
+    # jobs started before deadlines were recorded get the default timeout
+    return job.get("deadline") or job["start_date"] + timedelta(
+        seconds=_CALL_CLOUD_RUN_TIMEOUT_SEC
+    )
+
+
+def _sweep_stale_call_cloud_run_jobs(jobs_coll, now: datetime) -> int:
+    """
+    marks running jobs past their deadline as stale; returns their number
+    """
+    return jobs_coll.update_many(
+        {
+            "status": "running",
+            "$or": [
+                {"deadline": {"$lt": now}},
+                {
+                    "deadline": {"$exists": False},
+                    "start_date": {
+                        "$lt": now - timedelta(seconds=_CALL_CLOUD_RUN_TIMEOUT_SEC)
+                    },
+                },
+            ],
+        },
+        {"$set": {"status": "stale"}},
+    ).modified_count
+
+
+def _format_call_cloud_run_job(job: dict, now: datetime) -> str:
+    duration = job.get("duration_sec")
+    status = job["status"]
+    if status == "running" and _get_call_cloud_run_deadline(job) < now:
+        # not swept yet (see `_sweep_stale_call_cloud_run_jobs`)
+        status = "stale"
+    return " ".join(
+        [
+            f"`{job['job_id']}`",
+            f"`{job['function']}`",
+            status,
+            f"started {common.to_utc_datetime(job['start_date'], inverse=True).strftime('%Y-%m-%d %H:%M')}",
+            "" if duration is None else f"took {timedelta(seconds=round(duration))}",
+        ]
+    ).strip()
+
+
+async def _track_call_cloud_run_job(
+    job_id: str,
+    function_to_call: str,
+    url: str,
+    rest: typing.Optional[str],
+    timeout_sec: float,
+    send_message_cb: typing.Callable,
+    jobs_coll,
+) -> None:
+    logger = get_configured_logger("_track_call_cloud_run_job")
+    start_time = time.time()
+    try:
+        # `requests` timeout is per socket operation, hence the overall bound
+        res = await asyncio.wait_for(
+            asyncio.to_thread(__call_cloud_run__, url, rest, timeout_sec), timeout_sec
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"job {job_id} timed out after {timeout_sec} sec")
+        res = {"status": "failure", "reason": f"timeout ({timeout_sec} sec)"}
+    except Exception as e:
+        logger.error(f"job {job_id} failed: {e}", exc_info=True)
+        res = {"status": "failure", "reason": str(e)}
+    duration_sec = time.time() - start_time
+    logger.info(dict(job_id=job_id, res=res, duration_sec=duration_sec))
+
+    jobs_coll.update_one(
+        {"job_id": job_id},
+        {
+            "$set": {
+                "status": res["status"],
+                "result": res,
+                "end_date": common.to_utc_datetime(),
+                "duration_sec": duration_sec,
+            }
+        },
+    )
+    await send_message_cb(
+        f"job `{job_id}` (`{function_to_call}`) finished with status {res['status']} in {timedelta(seconds=round(duration_sec))}",
+        parse_mode="Markdown",
+    )
+
+
 async def call_cloud_run(
     text: str, send_message_cb: typing.Callable = None, mongo_client=None
 ):
+    """
+    /call -- list configured functions
+    /call <function> [text] -- call function (in background, unless its config has `mode: sync`)
+    /call status [job_id] -- show recent jobs or the given one
+    """
     logger = get_configured_logger("call_cloud_run")
     assert send_message_cb is not None
     assert mongo_client is not None
 
     text = text.strip().removeprefix("/call").strip()
     df_functions = pd.DataFrame(
-        mongo_client["logistics"]["20260102-call-cloud-run-config"].find()
+        mongo_client["logistics"][_CALL_CLOUD_RUN_CONFIG_COLL].find()
     )
+    jobs_coll = mongo_client["logistics"][_CALL_CLOUD_RUN_JOBS_COLL]
 
     if text == "":
         await send_message_cb(df_functions.to_string())
@@ -70,55 +177,110 @@ async def call_cloud_run(
     function_to_call, *rest = text.split(" ", 1)
     rest = None if len(rest) == 0 else rest[0]
     logger.info(dict(function_to_call=function_to_call, rest=rest))
-    (url,) = df_functions.loc[df_functions["name"].eq(function_to_call), "url"]
-    logger.info(dict(url=url))
-    __call_cloud_run__(url, rest)
 
-    await send_message_cb(f"called `{function_to_call}`")
+    if function_to_call == "status":
+        if rest is None:
+            jobs = list(
+                jobs_coll.find(sort=[("start_date", pymongo.DESCENDING)]).limit(10)
+            )
+        else:
+            jobs = list(jobs_coll.find({"job_id": rest.strip()}))
+        now = common.to_utc_datetime()
+        await send_message_cb(
+            "\n".join(_format_call_cloud_run_job(job, now) for job in jobs)
+            if len(jobs) > 0
+            else "no jobs found",
+            parse_mode="Markdown",
+        )
+        return
+
+    (function_config,) = df_functions[
+        df_functions["name"].eq(function_to_call)
+    ].to_dict(orient="records")
+    url, mode = function_config["url"], function_config.get("mode")
+    timeout_sec = function_config.get("timeout_sec")
+    timeout_sec = (
+        _CALL_CLOUD_RUN_TIMEOUT_SEC if pd.isna(timeout_sec) else float(timeout_sec)
+    )
+    logger.info(dict(url=url, mode=mode, timeout_sec=timeout_sec))
+
+    if mode == "sync":
+        __call_cloud_run__(url, rest, timeout_sec)
+        await send_message_cb(f"called `{function_to_call}`")
+        return
+
+    job_id = str(uuid.uuid4())[:8]
+    start_date = common.to_utc_datetime()
+    # jobs left over by dead instances are swept when new ones start
+    _sweep_stale_call_cloud_run_jobs(jobs_coll, start_date)
+    jobs_coll.insert_one(
+        {
+            "job_id": job_id,
+            "function": function_to_call,
+            "url": url,
+            "text": rest,
+            "status": "running",
+            "start_date": start_date,
+            "deadline": start_date + timedelta(seconds=timeout_sec),
+        }
+    )
+    task = asyncio.create_task(
+        _track_call_cloud_run_job(
+            job_id,
+            function_to_call,
+            url,
+            rest,
+            timeout_sec,
+            send_message_cb,
+            jobs_coll,
+        )
+    )
+    _CALL_CLOUD_RUN_TASKS.add(task)
+    task.add_done_callback(_CALL_CLOUD_RUN_TASKS.discard)
+
+    await send_message_cb(
+        f"called `{function_to_call}` as job `{job_id}`", parse_mode="Markdown"
+    )
 
 
 async def add_money(
     text: str, send_message_cb: typing.Callable = None, mongo_client=None
 ):
+    """
+    /money amount #category #tag %date comment -- one record per line
+    /money import <csv> -- see `common.money.iter_money_csv`
+    /money report [%Y-%m] -- monthly totals, from `alex.money_rollups`
+    """
     assert send_message_cb is not None
     assert mongo_client is not None
-    amount, *other = re.split(r" +", text)
-    amount = common.simple_math_eval.simple_math_eval(amount)
-    assert amount != 0, "amount==0"
-    tags = set()
-    date = datetime.now()
-    category = None
-    for i, x in enumerate(other):
-        if x.startswith("#"):
-            x = x[1:]
-            if x in ["food", "fun"]:
-                category = x
-            else:
-                tags.add(x)
-        elif x.startswith("%"):
-            x = x[1:]
-            if len(x) == 12:
-                date = datetime.strptime(x, "%Y%m%d%H%M")
-            elif len(x) == 6:
-                date = datetime.strptime(x, "%d%H%M")
-                now = datetime.now()
-                date = date.replace(**{k: getattr(now, k) for k in spl("year,month,")})
-        else:
-            break
-    i += 1
-    comment = " ".join(other[i:])
-    assert category is not None, "no category"
-    mongo_client[common.MONGO_COLL_NAME]["alex.money"].insert_one(
-        {
-            "date": common.to_utc_datetime(date),
-            "comment": comment,
-            "tags": sorted(list(tags)),
-            "category": category,
-            "amount": amount,
-        }
-    )
+    if text.startswith("report"):
+        month = text.removeprefix("report").strip()
+        await send_message_cb(
+            common.money.get_money_report(mongo_client, month if month else None)
+        )
+        return
+
+    categories = common.money.get_money_categories(mongo_client)
+    if text.startswith("import"):
+        res = common.money.insert_money_records(
+            common.money.iter_money_csv(
+                io.StringIO(text.removeprefix("import").strip()), categories
+            ),
+            mongo_client,
+        )
+        await send_message_cb(
+            f"imported {res['inserted']} records ({res['total']-res['inserted']} duplicates)"
+        )
+        return
+
+    records = common.money.parse_money_text(text, categories)
+    assert len(records) > 0, "no records"
+    res = common.money.insert_money_records(records, mongo_client, is_dedup=False)
     await send_message_cb(
-        f"added amount {amount} to category {category} on {date.strftime('%Y-%m-%d %H:%M')}"
+        "\n".join(
+            f"added amount {r.amount} to category {r.category} on {r.date.strftime('%Y-%m-%d %H:%M')}"
+            for r in res["records"]
+        )
     )
 
 
@@ -142,15 +304,20 @@ _SLEEP_CATS = ["sleeping", "social"]
 
 async def sleepend(_, send_message_cb=None, mongo_client=None):
     mongo_coll = mongo_client[common.MONGO_COLL_NAME]["alex.sleepingtimes"]
-    last_record = mongo_coll.find_one(sort=[("startsleep", pymongo.DESCENDING)])
-    cat = last_record["category"]
-    if common.get_sleeping_state(mongo_client) is None:
-        send_message_cb("not sleeping")
+    state = common.update_current_state(
+        mongo_client,
+        {"$set": {"sleeping": None}},
+        condition={"sleeping": {"$ne": None}},
+    )
+    if state is None:
+        await send_message_cb("not sleeping")
         return
-    _now = datetime.now()
+    cat, startsleep = state["sleeping"]["category"], state["sleeping"]["startsleep"]
+    endsleep = common.to_utc_datetime()
+    duration = endsleep - startsleep
     mongo_coll.update_one(
-        {"startsleep": last_record["startsleep"]},
-        {"$set": {"endsleep": common.to_utc_datetime(_now)}},
+        {"startsleep": startsleep},
+        {"$set": {"endsleep": endsleep, "duration_sec": duration.total_seconds()}},
     )
 
     # FIXME
@@ -159,7 +326,7 @@ async def sleepend(_, send_message_cb=None, mongo_client=None):
     # ).sanitize_mongo(cat)
 
     await send_message_cb(
-        f"end sleeping \"{cat}\" (was sleeping {(_now-timedelta(hours=9))-last_record['startsleep']})"
+        f'end sleeping "{cat}" (was sleeping {timedelta(seconds=round(duration.total_seconds()))})'
     )
 
 
@@ -340,23 +507,33 @@ async def tasknew(
 
 
 async def sleepstart(cat, send_message_cb=None, mongo_client=None):
+    state = common.get_current_state(mongo_client)
     if cat not in _SLEEP_CATS:
         await send_message_cb(f"cat \"{cat}\" not in \"{','.join(_SLEEP_CATS)}\"")
         return
-    elif common.get_sleeping_state(mongo_client) is not None:
+    elif state["sleeping"] is not None:
         await send_message_cb(f"already sleeping!")
         return
     elif (
-        mongo_client[common.MONGO_COLL_NAME]["alex.time"]
-        .find_one(sort=[("date", pymongo.DESCENDING)])
-        .get("category", None)
-        is None
+        state["last_time_slot"] is not None
+        and state["last_time_slot"]["category"] is None
     ):
         await send_message_cb(f"waiting for time reply!")
         return
 
+    startsleep = common.to_utc_datetime()
+    if (
+        common.update_current_state(
+            mongo_client,
+            {"$set": {"sleeping": {"category": cat, "startsleep": startsleep}}},
+            condition={"sleeping": None},
+        )
+        is None
+    ):
+        await send_message_cb(f"already sleeping!")
+        return
     mongo_coll = mongo_client[common.MONGO_COLL_NAME]["alex.sleepingtimes"]
-    mongo_coll.insert_one({"category": cat, "startsleep": common.to_utc_datetime()})
+    mongo_coll.insert_one({"category": cat, "startsleep": startsleep})
     await send_message_cb(f'start sleeping "{cat}"')
 
 
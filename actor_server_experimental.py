@@ -7,6 +7,8 @@ from fastapi import FastAPI, Request, Response
 from _actor_exp import tasknew, call_cloud_run, taskdone
 import functools
 from pymongo import MongoClient
+from common.keyed_executor import KeyedExecutor
+from common.command_router import CommandRouter, default_middlewares
 
 # --- Initialization ---
 logging.basicConfig(
@@ -20,6 +22,12 @@ bot = telegram.Bot(token=TELEGRAM_TOKEN) if TELEGRAM_TOKEN else None
 MONGO_URL = os.environ.get("MONGO_URL")
 
 mongo_client = MongoClient(MONGO_URL) if MONGO_URL else None
+
+# commands of one chat are processed in order, different chats in parallel
+ACTOR_MAX_CONCURRENCY = int(os.environ.get("ACTOR_MAX_CONCURRENCY", "8"))
+# created lazily, see `KeyedExecutor`
+_executor = None
+
 COMMANDS = {
     "/tasknew": tasknew,
     "/taskdone": taskdone,
@@ -27,6 +35,19 @@ COMMANDS = {
 }
 
 
+router = CommandRouter(
+    resources={"bot": bot, "mongo_client": mongo_client},
+    middlewares=default_middlewares(),
+)
+router.add_commands(COMMANDS)
+
+
+async def _process_command(chat_id, original_text: str, message_id=None) -> None:
+    logging.info(f"text: `{original_text}`")
+    if not await router.dispatch(chat_id, original_text, message_id=message_id):
+        logging.error(f"no match with `{original_text}`")
+
+
 # --- Webhook Endpoint ---
 @app.post("/")
 async def handle_callback(request: Request):
@@ -34,6 +55,7 @@ async def handle_callback(request: Request):
     Handles a callback_query payload forwarded from the dispatcher
     and echoes the original message text.
     """
+    global _executor
     if not bot:
         logging.error("TELEGRAM_TOKEN not configured.")
         return Response(content="Service not configured", status_code=500)
@@ -50,26 +72,15 @@ async def handle_callback(request: Request):
         chat_id = payload["message"]["chat"]["id"]
         original_text = payload["message"]["text"]
 
-        text = original_text.strip()
-        cmd, *_ = text.split()
-        logging.info(f"cmd: `{cmd}`")
-
-        is_matched: bool = False
-        for k, cb in COMMANDS.items():
-            if k == cmd:
-                await cb(
-                    text.removeprefix(cmd).strip(),
-                    # send_message=functools.partial(bot.send_message, chat_id=chat_id),
-                    send_message_cb=lambda text, **kwargs: bot.send_message(
-                        text=text, chat_id=chat_id, **kwargs
-                    ),
-                    mongo_client=mongo_client,
-                )
-                is_matched = True
-                break
-
-        if not is_matched:
-            logging.error(f"no match with {payload}")
+        if _executor is None:
+            _executor = KeyedExecutor(ACTOR_MAX_CONCURRENCY)
+        await _executor.run(
+            chat_id,
+            _process_command,
+            chat_id,
+            original_text,
+            message_id=payload["message"].get("message_id"),
+        )
 
     except (KeyError, IndexError) as e:
         logging.error(f"Error processing payload, missing key: {e}")
@@ -79,3 +90,12 @@ async def handle_callback(request: Request):
 
     # Always return a 200 OK to the calling dispatcher service.
     return "OK"
+
+
+@app.get("/metrics")
+async def metrics():
+    res = {"commands": router.metrics}
+    if _executor is not None:
+        res["in_flight"] = _executor.in_flight
+        res["chats"] = {str(k): v for k, v in _executor.metrics.items()}
+    return res
@@ -68,7 +68,12 @@ def _render_cmd(*args, **kwargs) -> str:
     "-A/-N", "--allow-unauthenticated/--no-allow-unauthenticated", default=False
 )
 @click.option(
-    "-C", "--command", type=click.Choice(["gunicorn", "uvicorn"]), default="gunicorn"
+    "-C",
+    "--command",
+    type=click.Choice(["gunicorn", "uvicorn"]),
+    default="uvicorn",
+    show_default=True,
+    help="`uvicorn` for ASGI apps (all current services), `gunicorn` for WSGI ones",
 )
 @click.option(
     "-P", "--project-id", required=True, envvar="GCLOUD_PROJECT", show_envvar=True
@@ -1,5 +1,13 @@
 import os
+import re
+import asyncio
+import collections
+import contextlib
+import hashlib
 import logging
+import time
+import typing
+from datetime import datetime, timedelta, timezone
 from fastapi import FastAPI, Request, Response
 import telegram
 from telegram.request import HTTPXRequest
@@ -10,6 +18,44 @@ TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 # Use the GEMINI_MODEL environment variable, with a fallback to the latest flash model
 GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash-latest")
+# concurrent generations per instance; the rest wait in queue
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "4"))
+# covers both waiting in queue and generation
+GEMINI_TIMEOUT_SEC = float(os.environ.get("GEMINI_TIMEOUT_SEC", "60"))
+# render response progressively, editing the message as chunks come
+GEMINI_STREAMING = os.environ.get("GEMINI_STREAMING", "0") == "1"
+# Telegram allows roughly one message (or edit) per second per chat
+GEMINI_STREAM_EDIT_INTERVAL_SEC = float(
+    os.environ.get("GEMINI_STREAM_EDIT_INTERVAL_SEC", "1.5")
+)
+TELEGRAM_MESSAGE_LIMIT = 4000
+# cache of responses, keyed by normalized prompt and model name; opt-in, since
+# repeated prompts (e.g. "tell me a joke") would get the same answer
+GEMINI_CACHE = os.environ.get("GEMINI_CACHE", "0") == "1"
+GEMINI_CACHE_TTL_SEC = float(os.environ.get("GEMINI_CACHE_TTL_SEC", str(24 * 60 * 60)))
+GEMINI_CACHE_MAX_BYTES = int(os.environ.get("GEMINI_CACHE_MAX_BYTES", str(8 * 2**20)))
+# optional persistent tier, shared between instances (needs `pymongo`)
+GEMINI_CACHE_MONGO_URL = os.environ.get("GEMINI_CACHE_MONGO_URL")
+# prompts whose answer depends on when they are asked are never cached
+GEMINI_CACHE_BYPASS_REGEX = os.environ.get(
+    "GEMINI_CACHE_BYPASS_REGEX",
+    r"\b(now|today|tonight|tomorrow|yesterday|current|currently|latest|recent"
+    r"|this (week|month|year)|weather|news|price|time|date)\b"
+    r"|今天|今日|現在|现在|明天|昨天|最近|天氣|天气",
+)
+# per-chat conversation memory: recent turns verbatim, older ones summarized
+GEMINI_MEMORY = os.environ.get("GEMINI_MEMORY", "0") == "1"
+# (estimated) tokens of history sent along with each prompt
+GEMINI_MEMORY_TOKEN_BUDGET = int(os.environ.get("GEMINI_MEMORY_TOKEN_BUDGET", "2000"))
+# optional persistence (needs `pymongo`), otherwise memory is per instance
+GEMINI_MEMORY_MONGO_URL = os.environ.get(
+    "GEMINI_MEMORY_MONGO_URL", GEMINI_CACHE_MONGO_URL
+)
+# `GEMINI_MODEL=fake` for local runs (no `GEMINI_API_KEY` needed)
+FAKE_GEMINI_LATENCY_SEC = float(os.environ.get("FAKE_GEMINI_LATENCY_SEC", "1"))
+FAKE_GEMINI_LATENCY_PER_TOKEN_SEC = float(
+    os.environ.get("FAKE_GEMINI_LATENCY_PER_TOKEN_SEC", "0")
+)
 
 # --- Initialization ---
 logging.basicConfig(
@@ -28,8 +74,60 @@ if TELEGRAM_BOT_TOKEN:
 else:
     logging.warning("TELEGRAM_BOT_TOKEN environment variable not set.")
 
+
+def estimate_tokens(contents) -> int:
+    """
+    rough, without a round-trip to `count_tokens`: ~4 ASCII chars per token,
+    one token per other char; `contents` is a prompt or a list of turns
+    """
+    if not isinstance(contents, str):
+        return sum(estimate_tokens(part) for c in contents for part in c["parts"])
+    ascii_count = sum(1 for ch in contents if ord(ch) < 128)
+    return ascii_count // 4 + (len(contents) - ascii_count) + 1
+
+
+class FakeGenerativeModel:
+    """
+    local stand-in for `genai.GenerativeModel`: echoes the (last) prompt after
+    a delay growing with the prompt size
+    """
+
+    def __init__(
+        self,
+        latency_sec: float = FAKE_GEMINI_LATENCY_SEC,
+        latency_per_token_sec: float = FAKE_GEMINI_LATENCY_PER_TOKEN_SEC,
+    ):
+        self._latency_sec = latency_sec
+        self._latency_per_token_sec = latency_per_token_sec
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        latency_sec = (
+            self._latency_sec + estimate_tokens(contents) * self._latency_per_token_sec
+        )
+        prompt = contents if isinstance(contents, str) else contents[-1]["parts"][-1]
+        text = f"(fake) {prompt}"
+        if not stream:
+            await asyncio.sleep(latency_sec)
+            return _FakeResponse(text)
+        return self._stream(text, latency_sec)
+
+    async def _stream(self, text: str, latency_sec: float):
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(latency_sec / len(words))
+            yield _FakeResponse(word if i == 0 else f" {word}")
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
 gemini_model = None
-if GEMINI_API_KEY:
+if GEMINI_MODEL_NAME == "fake":
+    gemini_model = FakeGenerativeModel()
+    logging.info("Initialized fake Gemini model")
+elif GEMINI_API_KEY:
     try:
         genai.configure(api_key=GEMINI_API_KEY)
         # --- FIX: Use the configured model name ---
@@ -40,6 +138,456 @@ if GEMINI_API_KEY:
 else:
     logging.warning("GEMINI_API_KEY environment variable not set.")
 
+# --- Bounded Generation ---
+GEMINI_METRICS = {
+    "requests": 0,
+    "in_flight": 0,
+    "waiting": 0,
+    "timeouts": 0,
+    "failures": 0,
+    "last_queue_wait_sec": None,
+    "max_queue_wait_sec": 0.0,
+    "total_queue_wait_sec": 0.0,
+    "last_generation_sec": None,
+    "max_generation_sec": 0.0,
+    "total_generation_sec": 0.0,
+    # streaming only
+    "last_ttft_sec": None,
+    "max_ttft_sec": 0.0,
+    "total_ttft_sec": 0.0,
+    "stream_messages": 0,
+    "stream_edits": 0,
+    "flood_waits": 0,
+    # cache
+    "cache_hits": 0,
+    "cache_persistent_hits": 0,
+    "cache_misses": 0,
+    "cache_bypassed": 0,
+    "cache_evictions": 0,
+    "cache_saved_sec": 0.0,
+    # conversation memory
+    "last_prompt_tokens": None,
+    "max_prompt_tokens": 0,
+    "total_prompt_tokens": 0,
+    "memory_summarizations": 0,
+}
+# created lazily: on Python 3.9 it binds to the loop current at creation
+_gemini_semaphore = None
+
+
+def _observe(name: str, value: float) -> None:
+    GEMINI_METRICS[f"last_{name}"] = value
+    GEMINI_METRICS[f"max_{name}"] = max(GEMINI_METRICS[f"max_{name}"], value)
+    GEMINI_METRICS[f"total_{name}"] += value
+
+
+@contextlib.asynccontextmanager
+async def _gemini_slot():
+    global _gemini_semaphore
+    if _gemini_semaphore is None:
+        _gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    start_time = time.perf_counter()
+    GEMINI_METRICS["waiting"] += 1
+    try:
+        await _gemini_semaphore.acquire()
+    finally:
+        GEMINI_METRICS["waiting"] -= 1
+    _observe("queue_wait_sec", time.perf_counter() - start_time)
+    GEMINI_METRICS["in_flight"] += 1
+    try:
+        yield
+    finally:
+        GEMINI_METRICS["in_flight"] -= 1
+        _gemini_semaphore.release()
+
+
+async def _bounded(coro):
+    GEMINI_METRICS["requests"] += 1
+    try:
+        return await asyncio.wait_for(coro, GEMINI_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        GEMINI_METRICS["timeouts"] += 1
+        raise
+    except Exception:
+        GEMINI_METRICS["failures"] += 1
+        raise
+
+
+async def _generate(contents) -> str:
+    async with _gemini_slot():
+        start_time = time.perf_counter()
+        response = await gemini_model.generate_content_async(contents)
+        _observe("generation_sec", time.perf_counter() - start_time)
+        return response.text
+
+
+async def generate_reply(contents) -> str:
+    """
+    non-blocking; at most `GEMINI_MAX_CONCURRENCY` generations at a time,
+    cancelled (with `asyncio.TimeoutError`) after `GEMINI_TIMEOUT_SEC`;
+    `contents` is a prompt or a list of turns
+    """
+    return await _bounded(_generate(contents))
+
+
+class _StreamWriter:
+    """
+    renders growing text into Telegram: the first message is sent right away,
+    then edited at most every `GEMINI_STREAM_EDIT_INTERVAL_SEC`; spills over
+    into new messages at `TELEGRAM_MESSAGE_LIMIT`
+    """
+
+    def __init__(self, chat_id):
+        self._chat_id = chat_id
+        self._finished = []
+        # of the current message
+        self._text = ""
+        self._message_id = None
+        self._shown_text = None
+        self._next_edit_time = 0.0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._finished) + self._text
+
+    async def append(self, chunk: str) -> None:
+        self._text += chunk
+        while len(self._text) > TELEGRAM_MESSAGE_LIMIT:
+            head = self._text[:TELEGRAM_MESSAGE_LIMIT]
+            self._text = self._text[TELEGRAM_MESSAGE_LIMIT:]
+            await self._render(head, force=True)
+            self._finished.append(head)
+            self._message_id, self._shown_text = None, None
+        await self._render(self._text)
+
+    async def flush(self) -> None:
+        await self._render(self._text, force=True)
+
+    async def _render(self, text: str, force: bool = False) -> None:
+        if not text or text == self._shown_text:
+            return
+        if self._message_id is not None and not force:
+            if time.perf_counter() < self._next_edit_time:
+                return
+        while True:
+            try:
+                if self._message_id is None:
+                    message = await bot.send_message(chat_id=self._chat_id, text=text)
+                    self._message_id = message.message_id
+                    GEMINI_METRICS["stream_messages"] += 1
+                else:
+                    await bot.edit_message_text(
+                        text=text, chat_id=self._chat_id, message_id=self._message_id
+                    )
+                    GEMINI_METRICS["stream_edits"] += 1
+                break
+            except telegram.error.RetryAfter as e:
+                GEMINI_METRICS["flood_waits"] += 1
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logging.warning(f"flood control, retry after {retry_after} sec")
+                if not force and self._message_id is not None:
+                    # intermediate edit: skip it, the next one will catch up
+                    self._next_edit_time = time.perf_counter() + retry_after
+                    return
+                await asyncio.sleep(retry_after)
+        self._shown_text = text
+        self._next_edit_time = time.perf_counter() + GEMINI_STREAM_EDIT_INTERVAL_SEC
+
+
+async def _stream(chat_id, contents) -> str:
+    async with _gemini_slot():
+        start_time = time.perf_counter()
+        writer = _StreamWriter(chat_id)
+        response = await gemini_model.generate_content_async(contents, stream=True)
+        async for chunk in response:
+            if not writer.text and chunk.text:
+                _observe("ttft_sec", time.perf_counter() - start_time)
+            await writer.append(chunk.text)
+        await writer.flush()
+        _observe("generation_sec", time.perf_counter() - start_time)
+        return writer.text
+
+
+async def stream_reply(chat_id, contents) -> str:
+    """
+    like `generate_reply`, but renders the response into `chat_id` as it is generated
+    """
+    return await _bounded(_stream(chat_id, contents))
+
+
+# --- Response Cache ---
+class PromptCache:
+    """
+    in-memory LRU with TTL, bounded by total size of cached responses;
+    optionally backed by Mongo collection (shared between instances)
+    """
+
+    def __init__(self, max_bytes: int, ttl_sec: float, mongo_coll=None):
+        self._max_bytes = max_bytes
+        self._ttl_sec = ttl_sec
+        self._mongo_coll = mongo_coll
+        # key -> (expires_at, text, generation_sec)
+        self._entries = collections.OrderedDict()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(prompt: str) -> str:
+        normalized = " ".join(prompt.lower().split()).rstrip("?!.。？！")
+        return hashlib.sha1(f"{GEMINI_MODEL_NAME}\n{normalized}".encode()).hexdigest()
+
+    async def get(self, key: str) -> typing.Optional[typing.Tuple[str, float]]:
+        """
+        returns `(text, generation_sec)`
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, text, generation_sec = entry
+            if expires_at >= time.time():
+                self._entries.move_to_end(key)
+                return text, generation_sec
+            self._pop(key)
+        if self._mongo_coll is None:
+            return None
+        r = await asyncio.to_thread(
+            self._mongo_coll.find_one,
+            {"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        )
+        if r is None:
+            return None
+        GEMINI_METRICS["cache_persistent_hits"] += 1
+        self._put_local(key, r["text"], r["generation_sec"])
+        return r["text"], r["generation_sec"]
+
+    async def put(self, key: str, text: str, generation_sec: float) -> None:
+        self._put_local(key, text, generation_sec)
+        if self._mongo_coll is not None:
+            await asyncio.to_thread(
+                self._mongo_coll.replace_one,
+                {"_id": key},
+                {
+                    "text": text,
+                    "generation_sec": generation_sec,
+                    # TTL index, see `common/indexes.py`
+                    "expires_at": datetime.now(timezone.utc)
+                    + timedelta(seconds=self._ttl_sec),
+                },
+                upsert=True,
+            )
+
+    def _put_local(self, key: str, text: str, generation_sec: float) -> None:
+        size = len(text.encode())
+        if size > self._max_bytes:
+            return
+        if key in self._entries:
+            self._pop(key)
+        self._entries[key] = (time.time() + self._ttl_sec, text, generation_sec)
+        self.bytes += size
+        while self.bytes > self._max_bytes:
+            self._pop(next(iter(self._entries)))
+            GEMINI_METRICS["cache_evictions"] += 1
+
+    def _pop(self, key: str) -> None:
+        _, text, _ = self._entries.pop(key)
+        self.bytes -= len(text.encode())
+
+
+prompt_cache = None
+if GEMINI_CACHE:
+    mongo_coll = None
+    if GEMINI_CACHE_MONGO_URL:
+        from pymongo import MongoClient
+
+        mongo_coll = MongoClient(GEMINI_CACHE_MONGO_URL)["logistics"][
+            "alex.gemini_prompt_cache"
+        ]
+    prompt_cache = PromptCache(
+        GEMINI_CACHE_MAX_BYTES, GEMINI_CACHE_TTL_SEC, mongo_coll=mongo_coll
+    )
+_cache_bypass_re = re.compile(GEMINI_CACHE_BYPASS_REGEX, re.IGNORECASE)
+
+
+async def _reply(chat_id, prompt: str, contents) -> str:
+    """
+    answers from cache when possible, otherwise generates (and caches) the response;
+    answers depending on conversation history are not cached
+    """
+    key = None
+    if prompt_cache is not None and isinstance(contents, str):
+        if _cache_bypass_re.search(prompt):
+            GEMINI_METRICS["cache_bypassed"] += 1
+        else:
+            key = PromptCache.key(prompt)
+    cached = None if key is None else await prompt_cache.get(key)
+    if cached is not None:
+        text, generation_sec = cached
+        GEMINI_METRICS["cache_hits"] += 1
+        GEMINI_METRICS["cache_saved_sec"] += generation_sec
+        await bot.send_message(chat_id=chat_id, text=text)
+        return text
+    if key is not None:
+        GEMINI_METRICS["cache_misses"] += 1
+
+    _observe("prompt_tokens", estimate_tokens(contents))
+    start_time = time.perf_counter()
+    if GEMINI_STREAMING:
+        text = await stream_reply(chat_id, contents)
+    else:
+        text = await generate_reply(contents)
+        await bot.send_message(chat_id=chat_id, text=text)
+    if key is not None and text:
+        await prompt_cache.put(key, text, time.perf_counter() - start_time)
+    return text
+
+
+# --- Conversation Memory ---
+class ConversationMemory:
+    """
+    per-chat history: recent turns are kept verbatim, older ones are rolled
+    into a running summary, so that history stays within `token_budget`
+    (estimated) tokens; persisted as `{"_id": chat_id, "summary", "turns"}`
+    with turns as `[role, text]` pairs
+    """
+
+    def __init__(self, token_budget: int, mongo_coll=None):
+        self._summary_budget = token_budget // 4
+        self._turns_budget = token_budget - self._summary_budget
+        self._mongo_coll = mongo_coll
+        # used when there is no `mongo_coll`
+        self._states = {}
+
+    async def load(self, chat_id) -> dict:
+        if self._mongo_coll is None:
+            return self._states.setdefault(chat_id, {"summary": "", "turns": []})
+        # not cached: other instances may have moved the conversation on
+        r = await asyncio.to_thread(self._mongo_coll.find_one, {"_id": chat_id})
+        if r is None:
+            return {"summary": "", "turns": []}
+        return {"summary": r["summary"], "turns": r["turns"]}
+
+    def contents(self, state: dict, prompt: str):
+        """
+        the prompt itself if there is no history yet
+        """
+        if not state["summary"] and not state["turns"]:
+            return prompt
+        res = []
+        if state["summary"]:
+            res.append(
+                {
+                    "role": "user",
+                    "parts": [
+                        f"Summary of our conversation so far: {state['summary']}"
+                    ],
+                }
+            )
+            res.append({"role": "model", "parts": ["OK."]})
+        # hard limit, in case summarization lags behind
+        turns, tokens = [], 0
+        for role, text in reversed(state["turns"]):
+            tokens += estimate_tokens(text)
+            if tokens > self._turns_budget:
+                break
+            turns.append({"role": role, "parts": [text]})
+        # must start with user turn
+        while turns and turns[-1]["role"] != "user":
+            turns.pop()
+        res.extend(reversed(turns))
+        res.append({"role": "user", "parts": [prompt]})
+        return res
+
+    async def append(self, chat_id, state: dict, prompt: str, response: str) -> None:
+        state["turns"].extend([["user", prompt], ["model", response]])
+        if sum(estimate_tokens(text) for _, text in state["turns"]) > (
+            self._turns_budget
+        ):
+            await self._summarize(state)
+        if self._mongo_coll is not None:
+            await asyncio.to_thread(
+                self._mongo_coll.replace_one,
+                {"_id": chat_id},
+                {
+                    "summary": state["summary"],
+                    "turns": state["turns"],
+                    "updated_at": datetime.now(timezone.utc),
+                },
+                upsert=True,
+            )
+
+    async def _summarize(self, state: dict) -> None:
+        # fold oldest turns (by pairs) until half of budget is left, so that
+        # summarization does not happen on every turn
+        old_turns = []
+        while state["turns"] and (
+            sum(estimate_tokens(text) for _, text in state["turns"])
+            > self._turns_budget // 2
+        ):
+            old_turns.extend(state["turns"][:2])
+            del state["turns"][:2]
+        transcript = "\n".join(f"{role}: {text}" for role, text in old_turns)
+        try:
+            summary = await generate_reply(
+                f"Update the summary of a conversation with its next part. "
+                f"Keep facts, names, decisions and open questions; "
+                f"at most {self._summary_budget * 3 // 4} words.\n\n"
+                f"Summary so far: {state['summary'] or '(none)'}\n\n"
+                f"Next part:\n{transcript}"
+            )
+        except Exception as e:
+            logging.error(f"summarization failed: {e}")
+            summary = f"{state['summary']}\n{transcript}"
+        GEMINI_METRICS["memory_summarizations"] += 1
+        # in case model ignores the limit (keep the most recent part)
+        while estimate_tokens(summary) > self._summary_budget:
+            summary = summary[max(1, len(summary) // 10) :]
+        state["summary"] = summary
+
+
+conversation_memory = None
+if GEMINI_MEMORY:
+    mongo_coll = None
+    if GEMINI_MEMORY_MONGO_URL:
+        from pymongo import MongoClient
+
+        mongo_coll = MongoClient(GEMINI_MEMORY_MONGO_URL)["logistics"][
+            "alex.gemini_conversations"
+        ]
+    conversation_memory = ConversationMemory(
+        GEMINI_MEMORY_TOKEN_BUDGET, mongo_coll=mongo_coll
+    )
+# turns of a chat are processed in order; chat_id -> [lock, users], dropped
+# when last user leaves (so that it does not grow with every chat ever seen)
+_chat_locks = {}
+
+
+@contextlib.asynccontextmanager
+async def _chat_lock(chat_id):
+    entry = _chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _chat_locks[chat_id]
+
+
+async def reply(chat_id, prompt: str) -> None:
+    if conversation_memory is None:
+        await _reply(chat_id, prompt, prompt)
+        return
+    async with _chat_lock(chat_id):
+        state = await conversation_memory.load(chat_id)
+        text = await _reply(
+            chat_id, prompt, conversation_memory.contents(state, prompt)
+        )
+        await conversation_memory.append(chat_id, state, prompt, text)
+
 
 # --- Webhook Endpoint ---
 @app.post("/")
@@ -75,10 +623,7 @@ async def telegram_webhook(request: Request) -> str:
 
     try:
         logging.info(f"Generating content with Gemini model '{GEMINI_MODEL_NAME}'...")
-        response = gemini_model.generate_content(user_text)
-        gemini_response_text = response.text
-
-        await bot.send_message(chat_id=chat_id, text=gemini_response_text)
+        await reply(chat_id, user_text)
         logging.info(f"Successfully sent Gemini response to chat_id {chat_id}")
 
     except Exception as e:
@@ -91,4 +636,15 @@ async def telegram_webhook(request: Request) -> str:
     return "OK"
 
 
+@app.get("/metrics")
+async def metrics():
+    res = dict(GEMINI_METRICS)
+    if prompt_cache is not None:
+        lookups = res["cache_hits"] + res["cache_misses"]
+        res["cache_hit_ratio"] = res["cache_hits"] / lookups if lookups else None
+        res["cache_entries"] = len(prompt_cache)
+        res["cache_bytes"] = prompt_cache.bytes
+    return res
+
+
 # For local development: uvicorn app:app --reload --host 0.0.0.0 --port 8080
@@ -59,16 +59,82 @@ TIME_CATS = [
 MONGO_COLL_NAME = "logistics"
 
 
+# single document `{"_id": "current", "sleeping": ..., "last_time_slot": ...}`,
+# kept in sync by the writes to `alex.sleepingtimes` and `alex.time`
+CURRENT_STATE_COLL_NAME = "alex.current_state"
+CURRENT_STATE_ID = "current"
+_CURRENT_STATE_TTL_SEC = 5
+_current_state_cache: dict = {"expires_at": 0.0, "state": None}
+
+
+def _rebuild_current_state(mongo_client) -> dict:
+    """
+    fallback for when current state document does not exist yet
+    """
+    last_sleep = mongo_client[MONGO_COLL_NAME]["alex.sleepingtimes"].find_one(
+        sort=[("startsleep", pymongo.DESCENDING)]
+    )
+    last_time = mongo_client[MONGO_COLL_NAME]["alex.time"].find_one(
+        sort=[("date", pymongo.DESCENDING)]
+    )
+    state = {
+        "sleeping": (
+            None
+            if last_sleep is None or last_sleep.get("endsleep") is not None
+            else {k: last_sleep[k] for k in ["category", "startsleep"]}
+        ),
+        "last_time_slot": (
+            None
+            if last_time is None
+            else {
+                k: last_time.get(k)
+                for k in ["date", "category", "telegram_message_id"]
+            }
+        ),
+    }
+    mongo_client[MONGO_COLL_NAME][CURRENT_STATE_COLL_NAME].replace_one(
+        {"_id": CURRENT_STATE_ID}, state, upsert=True
+    )
+    return {"_id": CURRENT_STATE_ID, **state}
+
+
+def get_current_state(mongo_client, use_cache: bool = True) -> dict:
+    if use_cache and _current_state_cache["expires_at"] >= time.time():
+        return _current_state_cache["state"]
+    state = mongo_client[MONGO_COLL_NAME][CURRENT_STATE_COLL_NAME].find_one(
+        {"_id": CURRENT_STATE_ID}
+    )
+    if state is None:
+        state = _rebuild_current_state(mongo_client)
+    _current_state_cache["state"] = state
+    _current_state_cache["expires_at"] = time.time() + _CURRENT_STATE_TTL_SEC
+    return state
+
+
+def update_current_state(
+    mongo_client, update: dict, condition: typing.Optional[dict] = None
+) -> typing.Optional[dict]:
+    """
+    atomically applies `update` if current state matches `condition`;
+    returns state before the update (or None if `condition` did not match)
+    """
+    # make sure the document exists, so that failed `condition` means mismatch
+    get_current_state(mongo_client)
+    _current_state_cache["expires_at"] = 0.0
+    return mongo_client[MONGO_COLL_NAME][CURRENT_STATE_COLL_NAME].find_one_and_update(
+        {"_id": CURRENT_STATE_ID, **({} if condition is None else condition)}, update
+    )
+
+
 def get_sleeping_state(mongo_client):
     """
     return None or (is_no_bother,state)
     """
-    mongo_coll = mongo_client[MONGO_COLL_NAME]["alex.sleepingtimes"]
-    last_record = mongo_coll.find_one(sort=[("startsleep", pymongo.DESCENDING)])
-    if last_record.get("endsleep", None) is not None:
+    sleeping = get_current_state(mongo_client)["sleeping"]
+    if sleeping is None:
         return None
     else:
-        cat = last_record["category"]
+        cat = sleeping["category"]
         return cat == "sleeping", cat
 
 
@@ -234,42 +300,113 @@ def _align_dt(dt, td, align_logic="left"):
     return datetime.fromtimestamp((dt.timestamp() // ts) * ts)
 
 
-def consecutive_periods(dates, td, is_normalize=True):
+def _to_wall_us(dates) -> np.ndarray:
+    """
+    naive (local) datetimes as int64 microseconds, on the same scale as
+    `_align_dt` uses (so that floor-division aligns them identically)
+    """
+    idx = pd.DatetimeIndex(dates)
+    if idx.tz is not None:
+        idx = idx.tz_convert(None) + pd.Timedelta(hours=_get_current_offset())
+    return idx.as_unit("us").asi8
+
+
+def _td_us(td: timedelta) -> int:
+    return td // timedelta(microseconds=1)
+
+
+def _normalize_us(
+    dates, td: timedelta, is_normalize: bool
+) -> typing.Tuple[np.ndarray, int]:
+    """
+    returns sorted unique int64 microseconds and `td` in microseconds
+    """
+    td_us = _td_us(td)
+    wall = _to_wall_us(dates)
     if is_normalize:
-        dates = sorted({_align_dt(dt, td) for dt in dates})
-    res = [{"start": dates[0]}]
-    res[-1]["anchor"] = res[-1]["start"]
-    while True:
-        if res[-1]["anchor"] + td in dates:
-            #            print(res)
-            res[-1]["anchor"] += td
-        #            print(res)
-        # exit(1)
-        else:
-            res[-1]["end"] = res[-1].pop("anchor")
-            # print((res[-1], dates[-1], len(dates), min(dates),len(res)))
-            if res[-1]["end"] >= dates[-1]:
-                break
-            else:
-                res.append({"start": res[-1]["end"] + td})
-                while res[-1]["start"] not in dates:
-                    res[-1]["start"] += td
-                res[-1]["anchor"] = res[-1]["start"]
-    return res
+        # align in epoch time, like `_align_dt`
+        offset_us = _get_current_offset() * 3600 * 10**6
+        wall = (wall - offset_us) // td_us * td_us + offset_us
+    return np.unique(wall), td_us
+
+
+def _from_wall_us(wall: np.ndarray) -> typing.List[datetime]:
+    return wall.astype("datetime64[us]").tolist()
+
+
+def consecutive_periods(dates, td, is_normalize=True):
+    """
+    returns sorted `[{"start": ..., "end": ...}]` of maximal runs of `dates` which
+    are `td` apart
+    """
+    wall, td_us = _normalize_us(dates, td, is_normalize)
+    if len(wall) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(wall) != td_us)
+    starts = np.concatenate([wall[:1], wall[breaks + 1]])
+    ends = np.concatenate([wall[breaks], wall[-1:]])
+    return [
+        {"start": start, "end": end}
+        for start, end in zip(_from_wall_us(starts), _from_wall_us(ends))
+    ]
 
 
 def fill_gaps(dates, td, is_normalize=True):
     """
     return sorted values
     """
-    #    click.echo(dates)
-    if is_normalize:
-        dates = sorted({_align_dt(dt, td) for dt in dates})
-    full_dates = [dates[0]]
-    while full_dates[-1] < dates[-1]:
-        full_dates.append(full_dates[-1] + td)
-    assert set(full_dates) >= set(dates), set(dates) - set(full_dates)
-    return sorted(set(full_dates) - set(dates))
+    wall, td_us = _normalize_us(dates, td, is_normalize)
+    if len(wall) == 0:
+        return []
+    assert ((wall - wall[0]) % td_us == 0).all(), "dates are not on the same grid"
+    return _from_wall_us(
+        np.setdiff1d(
+            np.arange(wall[0], wall[-1] + 1, td_us, dtype=np.int64),
+            wall,
+            assume_unique=True,
+        )
+    )
+
+
+def iter_consecutive_periods(
+    dates: typing.Iterable[datetime], td: timedelta, is_normalize: bool = True
+) -> typing.Iterator[dict]:
+    """
+    streaming version of `consecutive_periods` (e.g. for Mongo cursor);
+    `dates` should be sorted ascending, memory use is constant
+    """
+    period = None
+    for dt in dates:
+        if is_normalize:
+            dt = _align_dt(dt, td)
+        if period is None:
+            period = {"start": dt, "end": dt}
+        elif dt == period["end"]:
+            continue
+        elif dt == period["end"] + td:
+            period["end"] = dt
+        else:
+            assert dt > period["end"], "dates should be sorted"
+            yield period
+            period = {"start": dt, "end": dt}
+    if period is not None:
+        yield period
+
+
+def iter_fill_gaps(
+    dates: typing.Iterable[datetime], td: timedelta, is_normalize: bool = True
+) -> typing.Iterator[datetime]:
+    """
+    streaming version of `fill_gaps`; `dates` should be sorted ascending
+    """
+    prev = None
+    for period in iter_consecutive_periods(dates, td, is_normalize=is_normalize):
+        if prev is not None:
+            dt = prev["end"] + td
+            while dt < period["start"]:
+                yield dt
+                dt += td
+        prev = period
 
 
 def get_random_fn(
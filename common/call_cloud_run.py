@@ -55,9 +55,16 @@ def get_id_token(audience_url: str) -> typing.Optional[str]:
         return None
 
 
-def call_cloud_run(url: str, text: typing.Optional[str] = None) -> dict:
+# local stand-ins (e.g. `dummy_cloud_run_target.py`) do not need ID token
+_LOCAL_URL_PREFIXES = ("http://localhost", "http://127.0.0.1")
+
+
+def call_cloud_run(
+    url: str, text: typing.Optional[str] = None, timeout: typing.Optional[float] = None
+) -> dict:
     logger.info(f"Calling notification service at {url}...")
-    id_token = get_id_token(url)
+    is_local = url.startswith(_LOCAL_URL_PREFIXES)
+    id_token = "" if is_local else get_id_token(url)
     logger.info(f"got id token for {url}")
 
     # message_text = f"{public_url} #weeklyReport"
@@ -66,7 +73,7 @@ def call_cloud_run(url: str, text: typing.Optional[str] = None) -> dict:
     # else:
     #     message_text += " (Note: Used latest notebook from GitHub)"
 
-    if not id_token:
+    if not id_token and not is_local:
         logger.error("Could not get ID token. Skipping notification.")
         # Still return success, as the main task (report gen) worked
         return {
@@ -75,10 +82,10 @@ def call_cloud_run(url: str, text: typing.Optional[str] = None) -> dict:
         }
 
     try:
-        headers = {"Authorization": f"Bearer {id_token}"}
+        headers = {} if is_local else {"Authorization": f"Bearer {id_token}"}
         payload = {"message": {"text": text}} if text is not None else {}
 
-        response = requests.post(url, headers=headers, json=payload)
+        response = requests.post(url, headers=headers, json=payload, timeout=timeout)
         response.raise_for_status()  # Check for HTTP errors
 
         logger.info(
@@ -90,8 +97,10 @@ def call_cloud_run(url: str, text: typing.Optional[str] = None) -> dict:
         return {
             "status": "failure",
             "reason": "cannot call function",
+            "status_code": getattr(e.response, "status_code", None),
         }
 
     return {
         "status": "success",
+        "status_code": response.status_code,
     }
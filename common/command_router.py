@@ -0,0 +1,295 @@
+"""===============================================================================
+
+        FILE: common/command_router.py
+
+       USAGE: (not intended to be directly executed)
+
+ DESCRIPTION: command registry for actor servers: O(1) dispatch by command name,
+              aliases, middleware chain and injection of shared resources
+
+     OPTIONS: ---
+REQUIREMENTS: ---
+        BUGS: ---
+       NOTES: ---
+      AUTHOR: Alex Leontiev (alozz1991@gmail.com)
+ORGANIZATION:
+     VERSION: ---
+     CREATED: 2026-10-19T15:31:06.772940
+    REVISION: ---
+
+==============================================================================="""
+import collections
+import inspect
+import logging
+import re
+import time
+import typing
+
+# provided per call (by `CommandContext`), not by resources
+_CONTEXT_PARAMS = {"chat_id", "send_message_cb"}
+
+
+class Lazy:
+    """
+    resource created on first use (and shared afterwards)
+    """
+
+    def __init__(self, factory: typing.Callable[[], typing.Any]):
+        self._factory = factory
+        self._value = None
+        self._is_created = False
+
+    def get(self):
+        if not self._is_created:
+            self._value = self._factory()
+            self._is_created = True
+        return self._value
+
+
+class CommandContext:
+    def __init__(self, router, chat_id, text: str, command: str, args: str, **extra):
+        self.router = router
+        self.chat_id = chat_id
+        self.text = text
+        # canonical name (aliases resolved)
+        self.command = command
+        self.args = args
+        # e.g. `message_id` (used by `dedup`)
+        self.extra = extra
+
+    async def send_message_cb(self, text: str, **kwargs):
+        return await self.router.get_resource("bot").send_message(
+            text=text, chat_id=self.chat_id, **kwargs
+        )
+
+
+Middleware = typing.Callable[
+    [CommandContext, typing.Callable[[], typing.Awaitable[None]]],
+    typing.Awaitable[None],
+]
+
+
+class CommandRouter:
+    """
+    handlers have signature of `_actor` commands, i.e. `async def cmd(args, ...)`;
+    the rest of their parameters are injected by name: `chat_id`, `send_message_cb`
+    or any of `resources` (e.g. `mongo_client`, `bot`); `middlewares` wrap every
+    command, those given to `add` only that command (inside the former)
+    """
+
+    def __init__(
+        self,
+        resources: typing.Optional[dict] = None,
+        middlewares: typing.Optional[typing.List[Middleware]] = None,
+    ):
+        self._resources = {} if resources is None else dict(resources)
+        # outermost first
+        self._middlewares = [] if middlewares is None else list(middlewares)
+        # name (or alias) -> canonical name
+        self._names: typing.Dict[str, str] = {}
+        # canonical name -> (handler, names of injected parameters, middlewares)
+        self._handlers: typing.Dict[
+            str, typing.Tuple[typing.Callable, list, typing.List[Middleware]]
+        ] = {}
+        self.metrics: typing.Dict[str, dict] = {}
+
+    @property
+    def commands(self) -> typing.List[str]:
+        return list(self._handlers)
+
+    def add(
+        self,
+        name: str,
+        handler,
+        aliases: typing.Iterable[str] = (),
+        middlewares: typing.Iterable[Middleware] = (),
+    ) -> None:
+        _, *params = inspect.signature(handler).parameters
+        unknown = [
+            p for p in params if p not in _CONTEXT_PARAMS and p not in self._resources
+        ]
+        assert not unknown, f"{name}: cannot inject {unknown}"
+        for n in [name, *aliases]:
+            assert n not in self._names, f"`{n}` is already registered"
+            self._names[n] = name
+        self._handlers[name] = (handler, params, list(middlewares))
+
+    def add_commands(
+        self,
+        commands: typing.Dict[str, typing.Callable],
+        middlewares: typing.Iterable[Middleware] = (),
+    ) -> None:
+        """
+        `middlewares` are shared by the commands (e.g. one `rate_limit` bucket)
+        """
+        middlewares = list(middlewares)
+        for name, handler in commands.items():
+            self.add(name, handler, middlewares=middlewares)
+
+    def use(self, middleware: Middleware) -> None:
+        self._middlewares.append(middleware)
+
+    def get_resource(self, name: str):
+        resource = self._resources[name]
+        return resource.get() if isinstance(resource, Lazy) else resource
+
+    def resolve(self, text: str) -> typing.Optional[typing.Tuple[str, str]]:
+        """
+        returns `(canonical command name, args)`, or None if there is no such command
+        """
+        # split on any whitespace (e.g. multi-line `/money`), keeping newlines of args
+        cmd, *args = re.split(r"\s+", text.strip(), maxsplit=1)
+        # `/cmd@botname` form
+        name = self._names.get(cmd.split("@", 1)[0])
+        return None if name is None else (name, args[0] if args else "")
+
+    async def dispatch(self, chat_id, text: str, **extra) -> bool:
+        """
+        returns False if no command matched `text`
+        """
+        resolved = self.resolve(text)
+        if resolved is None:
+            return False
+        name, args = resolved
+        await self.call(name, chat_id, text, args, **extra)
+        return True
+
+    async def call(self, name: str, chat_id, text: str, args: str, **extra) -> None:
+        """
+        runs command `name` (canonical) through middlewares, bypassing `resolve`
+        """
+        ctx = CommandContext(self, chat_id, text, name, args, **extra)
+        handler, params, command_middlewares = self._handlers[name]
+
+        async def _call_handler():
+            kwargs = {
+                p: getattr(ctx, p) if p in _CONTEXT_PARAMS else self.get_resource(p)
+                for p in params
+            }
+            await handler(args, **kwargs)
+
+        call_next = _call_handler
+        for middleware in reversed([*self._middlewares, *command_middlewares]):
+            call_next = _bind(middleware, ctx, call_next)
+        await call_next()
+
+
+def _bind(middleware: Middleware, ctx: CommandContext, call_next):
+    async def _call():
+        await middleware(ctx, call_next)
+
+    return _call
+
+
+# --- middlewares ---
+def timing() -> Middleware:
+    """
+    per-command calls, errors and duration, kept in `router.metrics`
+    """
+
+    async def _timing(ctx: CommandContext, call_next) -> None:
+        metrics = ctx.router.metrics.setdefault(
+            ctx.command,
+            {
+                "calls": 0,
+                "errors": 0,
+                "last_sec": None,
+                "max_sec": 0.0,
+                "total_sec": 0.0,
+            },
+        )
+        start_time = time.perf_counter()
+        try:
+            await call_next()
+        except Exception:
+            metrics["errors"] += 1
+            raise
+        finally:
+            duration_sec = time.perf_counter() - start_time
+            metrics["calls"] += 1
+            metrics["last_sec"] = duration_sec
+            metrics["max_sec"] = max(metrics["max_sec"], duration_sec)
+            metrics["total_sec"] += duration_sec
+
+    return _timing
+
+
+def dedup(ttl_sec: float = 600) -> Middleware:
+    """
+    drops re-deliveries of the same message (needs `message_id` in `dispatch`)
+    """
+    # (chat_id, message_id) -> expires at
+    seen = collections.OrderedDict()
+
+    async def _dedup(ctx: CommandContext, call_next) -> None:
+        message_id = ctx.extra.get("message_id")
+        if message_id is None:
+            await call_next()
+            return
+        now = time.time()
+        while seen and next(iter(seen.values())) < now:
+            seen.popitem(last=False)
+        key = (ctx.chat_id, message_id)
+        if key in seen:
+            logging.warning(f"dropping duplicate of message {key}")
+            return
+        seen[key] = now + ttl_sec
+        await call_next()
+
+    return _dedup
+
+
+def rate_limit(per_minute: float = 30, burst: int = 10) -> Middleware:
+    """
+    token bucket per chat
+    """
+    # chat_id -> (tokens, updated at)
+    buckets = {}
+
+    async def _rate_limit(ctx: CommandContext, call_next) -> None:
+        now = time.time()
+        tokens, updated_at = buckets.get(ctx.chat_id, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * per_minute / 60)
+        if tokens < 1:
+            buckets[ctx.chat_id] = (tokens, now)
+            logging.warning(f"rate limit exceeded by {ctx.chat_id}")
+            await ctx.send_message_cb("too many commands, try again later")
+            return
+        buckets[ctx.chat_id] = (tokens - 1, now)
+        await call_next()
+
+    return _rate_limit
+
+
+def error_reporting() -> Middleware:
+    """
+    logs handler errors and replies with them (instead of failing silently)
+    """
+
+    async def _error_reporting(ctx: CommandContext, call_next) -> None:
+        try:
+            await call_next()
+        except Exception as e:
+            logging.error(f"{ctx.command} failed: {e}", exc_info=True)
+            try:
+                await ctx.send_message_cb(f"{ctx.command} failed: {e!r}")
+            except Exception as send_e:
+                logging.error(f"cannot report error: {send_e}")
+
+    return _error_reporting
+
+
+def default_middlewares() -> typing.List[Middleware]:
+    """
+    router-wide: only observes, i.e. does not change what users see
+    """
+    return [timing()]
+
+
+def interactive_middlewares() -> typing.List[Middleware]:
+    """
+    opt-in per command (see `CommandRouter.add`): drops re-delivered messages,
+    limits chats to 30 commands per minute (bursts of 10) and replies with
+    errors; fits commands typed by hand, not ones driven by scripts
+    """
+    return [dedup(), rate_limit(), error_reporting()]
@@ -0,0 +1,465 @@
+"""===============================================================================
+
+        FILE: common/hook_dispatch.py
+
+       USAGE: python3 -m common.hook_dispatch --help
+
+ DESCRIPTION: dispatch of Telegram updates to Cloud Run hooks: per-target circuit
+              breakers, hedged retries, dead letters (with replay) and bulkheads
+
+     OPTIONS: ---
+REQUIREMENTS: ---
+        BUGS: ---
+       NOTES: ---
+      AUTHOR: Alex Leontiev (alozz1991@gmail.com)
+ORGANIZATION:
+     VERSION: ---
+     CREATED: 2026-10-19T16:05:42.119384
+    REVISION: ---
+
+==============================================================================="""
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+import typing
+from datetime import datetime, timezone
+
+import pymongo
+import requests
+
+import common
+
+DEAD_LETTERS_COLL_NAME = "alex.hook_dead_letters"
+# results of `HookDispatcher.dispatch`
+DISPATCHED = "dispatched"
+# target did not process the update (cannot connect, circuit open, 5xx but
+# 502/504): replayable
+DEAD_LETTER = "dead_letter"
+# e.g. read timeout, 502/504: target may still process the update, so it is recorded
+# for inspection, but never replayed
+UNKNOWN = "unknown"
+# 4xx: target is up and refused the update, replay would not help
+REJECTED = "rejected"
+# local stand-ins (e.g. `actor_server` run by uvicorn) do not need ID token
+_LOCAL_URL_PREFIXES = ("http://localhost", "http://127.0.0.1")
+
+
+def get_id_token(audience_url: str) -> typing.Optional[str]:
+    """Fetches a Google-signed ID token for the given audience URL."""
+    token_url = f"http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/identity?audience={audience_url}"
+    token_headers = {"Metadata-Flavor": "Google"}
+    try:
+        token_response = requests.get(token_url, headers=token_headers)
+        token_response.raise_for_status()
+        return token_response.text
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to fetch ID token: {e}")
+        return None
+
+
+class IdTokenError(Exception):
+    pass
+
+
+def post_to_hook(
+    url: str, payload: dict, timeout: typing.Optional[float] = None
+) -> int:
+    """
+    blocking; raises on failure, returns status code
+    """
+    headers = {}
+    if not url.startswith(_LOCAL_URL_PREFIXES):
+        id_token = get_id_token(url)
+        if not id_token:
+            raise IdTokenError(f"cannot get ID token for {url}")
+        headers["Authorization"] = f"Bearer {id_token}"
+    response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+    response.raise_for_status()
+    return response.status_code
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    closed -> open when failure rate over the last `window` calls reaches
+    `failure_rate` (calls slower than `slow_call_sec` count as failures);
+    open -> half-open after `open_sec`, when a single probe call is let through;
+    half-open -> closed (or back to open) depending on the probe
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_sec: typing.Optional[float] = None,
+        open_sec: float = 30,
+    ):
+        self._min_calls = min_calls
+        self._failure_rate = failure_rate
+        self._slow_call_sec = slow_call_sec
+        self._open_sec = open_sec
+        # True for failed calls
+        self._calls = collections.deque(maxlen=window)
+        self._opened_at = None
+        self._is_probing = False
+        self.state = self.CLOSED
+        self.metrics = {
+            "calls": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0,
+            "last_latency_sec": None,
+            "max_latency_sec": 0.0,
+            "total_latency_sec": 0.0,
+        }
+
+    @property
+    def failure_rate(self) -> typing.Optional[float]:
+        return sum(self._calls) / len(self._calls) if self._calls else None
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self._open_sec:
+                self.metrics["rejected"] += 1
+                return False
+            self.state, self._is_probing = self.HALF_OPEN, False
+        if self.state == self.HALF_OPEN:
+            if self._is_probing:
+                self.metrics["rejected"] += 1
+                return False
+            self._is_probing = True
+        return True
+
+    def record(self, is_success: bool, latency_sec: float) -> None:
+        is_failure = not is_success or (
+            self._slow_call_sec is not None and latency_sec > self._slow_call_sec
+        )
+        self.metrics["calls"] += 1
+        self.metrics["failures"] += is_failure
+        self.metrics["last_latency_sec"] = latency_sec
+        self.metrics["max_latency_sec"] = max(
+            self.metrics["max_latency_sec"], latency_sec
+        )
+        self.metrics["total_latency_sec"] += latency_sec
+        if self.state == self.HALF_OPEN:
+            self._is_probing = False
+            if is_failure:
+                self._open()
+            else:
+                self.state = self.CLOSED
+                self._calls.clear()
+            return
+        self._calls.append(is_failure)
+        if (
+            self.state == self.CLOSED
+            and len(self._calls) >= self._min_calls
+            and self.failure_rate >= self._failure_rate
+        ):
+            self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.metrics["opened"] += 1
+
+
+class BulkheadFullError(Exception):
+    def __init__(self, route: str, retry_after_sec: float):
+        super().__init__(f"too many calls in flight for `{route}`")
+        self.route = route
+        self.retry_after_sec = retry_after_sec
+
+
+class Bulkhead:
+    """
+    caps calls in flight per route (e.g. hook prefix) and in total; unlike
+    `asyncio.Semaphore`, rejects instead of queueing, so that the caller can
+    push back (e.g. Telegram redelivers the update later)
+    """
+
+    def __init__(self, max_concurrency: int, retry_after_sec: float = 5):
+        self._max_concurrency = max_concurrency
+        self._retry_after_sec = retry_after_sec
+        self.in_flight = 0
+        self.rejected = 0
+        self.metrics: typing.Dict[str, dict] = {}
+
+    @contextlib.contextmanager
+    def acquire(self, route: str, max_concurrency: typing.Optional[int] = None):
+        """
+        `max_concurrency` of the route (None for only the global cap); raises
+        `BulkheadFullError` if either cap is reached
+        """
+        metrics = self.metrics.setdefault(
+            route, {"in_flight": 0, "max_in_flight": 0, "calls": 0, "rejected": 0}
+        )
+        if self.in_flight >= self._max_concurrency or (
+            max_concurrency is not None and metrics["in_flight"] >= max_concurrency
+        ):
+            metrics["rejected"] += 1
+            self.rejected += 1
+            raise BulkheadFullError(route, self._retry_after_sec)
+        self.in_flight += 1
+        metrics["in_flight"] += 1
+        metrics["max_in_flight"] = max(metrics["max_in_flight"], metrics["in_flight"])
+        metrics["calls"] += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            metrics["in_flight"] -= 1
+
+    def get_metrics(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self._max_concurrency,
+            "rejected": self.rejected,
+            "routes": self.metrics,
+        }
+
+
+class HookDispatcher:
+    """
+    posts updates to hooks, one `CircuitBreaker` per url; for idempotent hooks,
+    a second attempt is started if the first one fails before reaching the target
+    (see `_is_retryable`), or is still running after `hedge_after_sec` (whichever
+    succeeds first wins); updates which could not be delivered go to
+    `DEAD_LETTERS_COLL_NAME`
+
+    hedging only pays off when the first attempt is stuck on a cold start (the
+    hedge lands on another instance): actor servers run commands of a chat one
+    at a time, so against a warm actor the hedge just queues behind the first
+    attempt and then runs the command again
+    """
+
+    def __init__(
+        self,
+        mongo_client,
+        timeout_sec: float = 30,
+        hedge_after_sec: float = 3,
+        breaker_kwargs: typing.Optional[dict] = None,
+    ):
+        self._mongo_client = mongo_client
+        self._timeout_sec = timeout_sec
+        self._hedge_after_sec = hedge_after_sec
+        self._breaker_kwargs = {} if breaker_kwargs is None else breaker_kwargs
+        self._breakers: typing.Dict[str, CircuitBreaker] = {}
+        self.metrics = {
+            "dispatched": 0,
+            "hedges": 0,
+            "retries": 0,
+            "dead_letters": 0,
+            "unknown": 0,
+            "rejected": 0,
+        }
+
+    def get_breaker(self, url: str) -> CircuitBreaker:
+        if url not in self._breakers:
+            self._breakers[url] = CircuitBreaker(**self._breaker_kwargs)
+        return self._breakers[url]
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            "breakers": {
+                url: {
+                    "state": breaker.state,
+                    "failure_rate": breaker.failure_rate,
+                    **breaker.metrics,
+                }
+                for url, breaker in self._breakers.items()
+            },
+        }
+
+    async def dispatch(self, url: str, payload: dict, idempotent: bool = False) -> str:
+        """
+        returns one of `DISPATCHED`, `DEAD_LETTER`, `UNKNOWN` or `REJECTED`
+        """
+        try:
+            if idempotent:
+                await self._hedged_call(url, payload)
+            else:
+                await self._call(url, payload)
+        except Exception as e:
+            logging.error(f"Error calling target service {url}: {e!r}")
+            outcome = _classify_error(e)
+            if outcome == REJECTED:
+                self.metrics["rejected"] += 1
+                return outcome
+            self.metrics["dead_letters" if outcome == DEAD_LETTER else "unknown"] += 1
+            await asyncio.to_thread(
+                self._mongo_client[common.MONGO_COLL_NAME][
+                    DEAD_LETTERS_COLL_NAME
+                ].insert_one,
+                {
+                    "url": url,
+                    "payload": payload,
+                    "error": repr(e),
+                    "outcome": outcome,
+                    "created_at": datetime.now(timezone.utc),
+                    "attempts": 0,
+                    "replayed_at": None,
+                },
+            )
+            return outcome
+        self.metrics["dispatched"] += 1
+        return DISPATCHED
+
+    async def _call(self, url: str, payload: dict) -> None:
+        breaker = self.get_breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit for {url} is {breaker.state}")
+        start_time = time.perf_counter()
+        try:
+            status_code = await asyncio.to_thread(
+                post_to_hook, url, payload, self._timeout_sec
+            )
+        except requests.exceptions.HTTPError as e:
+            # 4xx: target is up, it is the request which is wrong
+            breaker.record(
+                e.response is not None and e.response.status_code < 500,
+                time.perf_counter() - start_time,
+            )
+            raise
+        except Exception:
+            breaker.record(False, time.perf_counter() - start_time)
+            raise
+        breaker.record(True, time.perf_counter() - start_time)
+        logging.info(f"Successfully dispatched to {url}. Status: {status_code}")
+
+    async def _hedged_call(self, url: str, payload: dict) -> None:
+        first = asyncio.ensure_future(self._call(url, payload))
+        done, _ = await asyncio.wait({first}, timeout=self._hedge_after_sec)
+        if done:
+            if first.exception() is None:
+                return
+            if not _is_retryable(first.exception()):
+                raise first.exception()
+            logging.warning(f"retrying {url} after {first.exception()!r}")
+            self.metrics["retries"] += 1
+            await self._call(url, payload)
+            return
+
+        logging.warning(f"{url} is slow, hedging")
+        self.metrics["hedges"] += 1
+        pending = {first, asyncio.ensure_future(self._call(url, payload))}
+        exc = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    # loser is left to finish (and to be recorded by the breaker)
+                    _detach(pending)
+                    return
+                exc = task.exception()
+                if not _is_retryable(exc):
+                    # e.g. 4xx: the other attempt would fail the same way
+                    _detach(pending)
+                    raise exc
+        raise exc
+
+
+def _detach(tasks: typing.Iterable[asyncio.Future]) -> None:
+    # retrieves exceptions of tasks nobody awaits, so that they are not logged
+    for task in tasks:
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+def _classify_error(e: Exception) -> str:
+    if isinstance(e, requests.exceptions.HTTPError):
+        status_code = None if e.response is None else e.response.status_code
+        if status_code is not None and status_code < 500:
+            return REJECTED
+        # from a proxy in front of target, which may have got the request
+        if status_code in (502, 504):
+            return UNKNOWN
+        return DEAD_LETTER
+    # `ConnectTimeout` is a `ConnectionError` too: request never reached target
+    if isinstance(
+        e, (CircuitOpenError, IdTokenError, requests.exceptions.ConnectionError)
+    ):
+        return DEAD_LETTER
+    return UNKNOWN
+
+
+def _is_retryable(e: Exception) -> bool:
+    """
+    target did not get the request, and a second attempt right away may succeed
+    """
+    return _classify_error(e) == DEAD_LETTER and not isinstance(e, CircuitOpenError)
+
+
+def replay_dead_letters(mongo_client, limit: int = 100, timeout: float = 30) -> dict:
+    """
+    re-posts not yet replayed dead letters, oldest first; `UNKNOWN` outcomes are
+    skipped (the target may have processed them)
+    """
+    coll = mongo_client[common.MONGO_COLL_NAME][DEAD_LETTERS_COLL_NAME]
+    res = {"replayed": 0, "failed": 0}
+    for r in coll.find({"replayed_at": None, "outcome": {"$ne": UNKNOWN}}).sort(
+        "created_at", pymongo.ASCENDING
+    )[:limit]:
+        try:
+            post_to_hook(r["url"], r["payload"], timeout=timeout)
+        except Exception as e:
+            logging.error(f"{r['_id']}: {e!r}")
+            coll.update_one(
+                {"_id": r["_id"]}, {"$inc": {"attempts": 1}, "$set": {"error": repr(e)}}
+            )
+            res["failed"] += 1
+        else:
+            coll.update_one(
+                {"_id": r["_id"]},
+                {
+                    "$inc": {"attempts": 1},
+                    "$set": {"replayed_at": datetime.now(timezone.utc)},
+                },
+            )
+            res["replayed"] += 1
+    return res
+
+
+if __name__ == "__main__":
+    import click
+    from pymongo import MongoClient
+
+    @click.group()
+    @click.option("--mongo-url", required=True, envvar="MONGO_URL", show_envvar=True)
+    @click.pass_context
+    def hook_dispatch(ctx, mongo_url):
+        logging.basicConfig(level=logging.INFO)
+        ctx.obj = MongoClient(mongo_url)
+
+    @hook_dispatch.command(name="list")
+    @click.pass_obj
+    def list_(mongo_client):
+        for r in (
+            mongo_client[common.MONGO_COLL_NAME][DEAD_LETTERS_COLL_NAME]
+            .find({"replayed_at": None})
+            .sort("created_at", pymongo.ASCENDING)
+        ):
+            text = r["payload"].get("message", {}).get("text")
+            click.echo(
+                f"{r['created_at']} {r.get('outcome', DEAD_LETTER)} {r['url']} `{text}`: {r['error']}"
+            )
+
+    @hook_dispatch.command()
+    @click.option("-n", "--limit", type=int, default=100, show_default=True)
+    @click.pass_obj
+    def replay(mongo_client, limit):
+        """
+        needs metadata server for ID tokens (i.e. GCP), unless urls are local
+        """
+        click.echo(replay_dead_letters(mongo_client, limit=limit))
+
+    hook_dispatch()
@@ -0,0 +1,232 @@
+"""===============================================================================
+
+        FILE: common/indexes.py
+
+       USAGE: python3 -m common.indexes --help
+
+ DESCRIPTION: registry of indexes (and hot queries relying on them) for all
+              collections the services touch
+
+     OPTIONS: ---
+REQUIREMENTS: ---
+        BUGS: ---
+       NOTES: ---
+      AUTHOR: Alex Leontiev (alozz1991@gmail.com)
+ORGANIZATION:
+     VERSION: ---
+     CREATED: 2026-10-19T13:05:51.202718
+    REVISION: ---
+
+==============================================================================="""
+import logging
+import typing
+from datetime import datetime
+
+import pymongo
+
+import common
+
+
+class IndexSpec(typing.NamedTuple):
+    database: str
+    collection: str
+    keys: typing.List[typing.Tuple[str, int]]
+    # `create_index` options (e.g. `unique`)
+    options: typing.Optional[dict] = None
+
+
+class HotQuery(typing.NamedTuple):
+    database: str
+    collection: str
+    filter: dict
+    sort: typing.Optional[typing.List[typing.Tuple[str, int]]] = None
+
+
+_L = common.MONGO_COLL_NAME
+# `PYASSISTANTBOT_MONGO_URL`, see `_gstasks.setup_ctx_obj`
+_GSTASKS = "gstasks"
+_ASC, _DESC = pymongo.ASCENDING, pymongo.DESCENDING
+_SOME_DATE = datetime(2026, 1, 1)
+
+INDEXES: typing.List[IndexSpec] = [
+    IndexSpec(_L, "alex.time", [("telegram_message_id", _ASC)]),
+    IndexSpec(_L, "alex.time", [("date", _DESC)]),
+    IndexSpec(_L, "alex.sleepingtimes", [("startsleep", _DESC)]),
+    IndexSpec(_L, "alex.habits", [("enabled", _ASC), ("next_due", _ASC)]),
+    IndexSpec(_L, "alex.habitspunch2", [("name", _ASC), ("date", _ASC)]),
+    IndexSpec(_L, "alex.habitspunch2", [("due", _ASC), ("status", _ASC)]),
+    IndexSpec(
+        _L,
+        "alex.money",
+        [("content_hash", _ASC)],
+        {
+            "unique": True,
+            "partialFilterExpression": {"content_hash": {"$exists": True}},
+        },
+    ),
+    IndexSpec(
+        _L, "alex.money_rollups", [("period", _ASC), ("key", _ASC)], {"unique": True}
+    ),
+    IndexSpec(_L, "alex.money_rollups", [("month", _ASC)]),
+    IndexSpec(_L, "alex.time_daily_stats", [("day", _ASC)], {"unique": True}),
+    # TTL index (see `app.PromptCache`)
+    IndexSpec(
+        _L,
+        "alex.gemini_prompt_cache",
+        [("expires_at", _ASC)],
+        {"expireAfterSeconds": 0},
+    ),
+    # see `common.hook_dispatch.replay_dead_letters`
+    IndexSpec(
+        _L, "alex.hook_dead_letters", [("replayed_at", _ASC), ("created_at", _ASC)]
+    ),
+    IndexSpec(_L, "20260102-call-cloud-run-jobs", [("job_id", _ASC)]),
+    IndexSpec(_L, "20260102-call-cloud-run-jobs", [("start_date", _DESC)]),
+    IndexSpec(_GSTASKS, "tasks", [("uuid", _ASC)]),
+    IndexSpec(_GSTASKS, "engage", [("mark", _ASC), ("dt", _DESC)]),
+]
+
+HOT_QUERIES: typing.List[HotQuery] = [
+    HotQuery(_L, "alex.time", {"telegram_message_id": 1}),
+    HotQuery(_L, "alex.time", {"date": {"$gte": _SOME_DATE}}),
+    HotQuery(_L, "alex.time", {}, [("date", _DESC)]),
+    HotQuery(_L, "alex.time", {"date": {"$gte": _SOME_DATE}, "category": None}),
+    HotQuery(_L, "alex.sleepingtimes", {}, [("startsleep", _DESC)]),
+    HotQuery(
+        _L,
+        "alex.habits",
+        {
+            "enabled": True,
+            "$or": [{"next_due": {"$lte": _SOME_DATE}}, {"next_due": None}],
+        },
+    ),
+    HotQuery(_L, "alex.habitspunch2", {"name": "habit", "date": _SOME_DATE}),
+    HotQuery(
+        _L,
+        "alex.habitspunch2",
+        {
+            "due": {"$gte": _SOME_DATE, "$lt": _SOME_DATE},
+            "status": {"$exists": False},
+        },
+    ),
+    HotQuery(_L, "alex.money", {"content_hash": "0" * 40}),
+    HotQuery(_L, "alex.money_rollups", {"month": "2026-01"}),
+    HotQuery(_L, "alex.time_daily_stats", {"day": "2026-01-01"}),
+    HotQuery(
+        _L,
+        "alex.hook_dead_letters",
+        {"replayed_at": None, "outcome": {"$ne": "unknown"}},
+        [("created_at", _ASC)],
+    ),
+    HotQuery(_L, "20260102-call-cloud-run-jobs", {"job_id": "00000000"}),
+    HotQuery(_L, "20260102-call-cloud-run-jobs", {}, [("start_date", _DESC)]),
+    HotQuery(_GSTASKS, "tasks", {"uuid": "00000000-0000-0000-0000-000000000000"}),
+    HotQuery(_GSTASKS, "engage", {"mark": "engage"}, [("dt", _DESC)]),
+]
+
+
+def ensure_indexes(
+    mongo_client, databases: typing.Optional[typing.Collection[str]] = None
+) -> typing.List[str]:
+    """
+    idempotent; `databases` restricts registry to the databases hosted by
+    `mongo_client`; returns names of the indexes
+    """
+    logger = logging.getLogger("ensure_indexes")
+    res = []
+    for spec in INDEXES:
+        if databases is not None and spec.database not in databases:
+            continue
+        name = mongo_client[spec.database][spec.collection].create_index(
+            spec.keys, **(spec.options or {})
+        )
+        logger.info(f"{spec.database}.{spec.collection}: {name}")
+        res.append(name)
+    return res
+
+
+def _get_stages(plan: dict) -> typing.Iterator[str]:
+    for k, v in plan.items():
+        if k == "stage":
+            yield v
+        elif isinstance(v, dict):
+            yield from _get_stages(v)
+        elif isinstance(v, list):
+            for x in v:
+                if isinstance(x, dict):
+                    yield from _get_stages(x)
+
+
+def get_docs_examined(coll, filter: dict) -> typing.Optional[int]:
+    """
+    `totalDocsExamined` of `filter` (runs the query); None without a real `mongod`
+    """
+    try:
+        return coll.find(filter).explain()["executionStats"]["totalDocsExamined"]
+    except (AttributeError, KeyError, pymongo.errors.OperationFailure) as e:
+        logging.warning(f"cannot explain {filter}: {e!r}")
+        return None
+
+
+def check_hot_queries(
+    mongo_client, databases: typing.Optional[typing.Collection[str]] = None
+) -> typing.List[HotQuery]:
+    """
+    returns hot queries whose winning plan does a COLLSCAN (needs a real `mongod`)
+    """
+    res = []
+    for q in HOT_QUERIES:
+        if databases is not None and q.database not in databases:
+            continue
+        cursor = mongo_client[q.database][q.collection].find(q.filter)
+        if q.sort is not None:
+            cursor = cursor.sort(q.sort)
+        stages = set(_get_stages(cursor.explain()["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            res.append(q)
+    return res
+
+
+if __name__ == "__main__":
+    import click
+    from pymongo import MongoClient
+
+    @click.group()
+    @click.option("--mongo-url", required=True, envvar="MONGO_URL", show_envvar=True)
+    @click.option(
+        "-d",
+        "--database",
+        "databases",
+        multiple=True,
+        help="databases hosted by `--mongo-url` (default: all in registry)",
+    )
+    @click.pass_context
+    def indexes(ctx, mongo_url, databases):
+        logging.basicConfig(level=logging.INFO)
+        ctx.obj = dict(
+            mongo_client=MongoClient(mongo_url),
+            databases=databases if databases else None,
+        )
+
+    @indexes.command()
+    @click.pass_obj
+    def ensure(obj):
+        ensure_indexes(**obj)
+
+    @indexes.command()
+    @click.option("--ensure/--no-ensure", default=False)
+    @click.pass_obj
+    def check(obj, ensure):
+        """
+        fails if a hot query does COLLSCAN; run against local stand-in `mongod`
+        """
+        if ensure:
+            ensure_indexes(**obj)
+        failed = check_hot_queries(**obj)
+        for q in failed:
+            click.echo(f"COLLSCAN: {q}", err=True)
+        if failed:
+            raise click.ClickException(f"{len(failed)} hot queries do COLLSCAN")
+        click.echo("OK")
+
+    indexes()
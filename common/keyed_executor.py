@@ -0,0 +1,83 @@
+"""===============================================================================
+
+        FILE: common/keyed_executor.py
+
+       USAGE: (not intended to be directly executed)
+
+ DESCRIPTION: per-key FIFO execution of coroutines, with parallelism across keys
+
+     OPTIONS: ---
+REQUIREMENTS: ---
+        BUGS: ---
+       NOTES: ---
+      AUTHOR: Alex Leontiev (alozz1991@gmail.com)
+ORGANIZATION:
+     VERSION: ---
+     CREATED: 2026-10-19T15:02:17.418305
+    REVISION: ---
+
+==============================================================================="""
+import asyncio
+import time
+import typing
+
+
+class KeyedExecutor:
+    """
+    runs jobs of the same key (e.g. chat id) one at a time, in order of submission,
+    and jobs of different keys concurrently, at most `max_concurrency` at a time;
+    should be created from within the running event loop
+    """
+
+    def __init__(self, max_concurrency: int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # key -> future, done when the last submitted job of the key is done
+        self._tails: typing.Dict[typing.Hashable, asyncio.Future] = {}
+        self.in_flight = 0
+        self.metrics: typing.Dict[typing.Hashable, dict] = {}
+
+    async def run(self, key: typing.Hashable, fn, *args, **kwargs):
+        """
+        awaits `fn(*args, **kwargs)` when it is the turn of `key`; returns its result
+        """
+        metrics = self.metrics.setdefault(
+            key,
+            {
+                "depth": 0,
+                "max_depth": 0,
+                "processed": 0,
+                "last_wait_sec": None,
+                "max_wait_sec": 0.0,
+                "total_wait_sec": 0.0,
+            },
+        )
+        prev = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        metrics["depth"] += 1
+        metrics["max_depth"] = max(metrics["max_depth"], metrics["depth"])
+        start_time = time.perf_counter()
+        try:
+            if prev is not None:
+                # unlike `await prev`, does not cancel `prev` if we are cancelled
+                await asyncio.wait({prev})
+            async with self._semaphore:
+                wait_sec = time.perf_counter() - start_time
+                metrics["last_wait_sec"] = wait_sec
+                metrics["max_wait_sec"] = max(metrics["max_wait_sec"], wait_sec)
+                metrics["total_wait_sec"] += wait_sec
+                self.in_flight += 1
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.in_flight -= 1
+                    metrics["processed"] += 1
+        finally:
+            metrics["depth"] -= 1
+            if prev is None or prev.done():
+                done.set_result(None)
+            else:
+                # cancelled while waiting: next job still has to wait for `prev`
+                prev.add_done_callback(lambda _: done.set_result(None))
+            if self._tails.get(key) is done and done.done():
+                del self._tails[key]
@@ -0,0 +1,110 @@
+"""===============================================================================
+
+        FILE: common/lease.py
+
+       USAGE: (not intended to be directly executed)
+
+ DESCRIPTION: Mongo-backed leases (with fencing tokens) for scheduled jobs
+
+     OPTIONS: ---
+REQUIREMENTS: ---
+        BUGS: ---
+       NOTES: ---
+      AUTHOR: Alex Leontiev (alozz1991@gmail.com)
+ORGANIZATION:
+     VERSION: ---
+     CREATED: 2026-10-19T14:20:44.305120
+    REVISION: ---
+
+==============================================================================="""
+import os
+import socket
+import time
+import typing
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import common
+
+# one document per job: `{"_id": name, "holder", "token", "expires_at", ...}`
+LEASES_COLL_NAME = "alex.job_leases"
+DEFAULT_LEASE_TTL = timedelta(minutes=10)
+# identifies this process as lease holder
+HOLDER_ID = f"{socket.gethostname()}-{os.getpid()}-{str(uuid.uuid4())[:8]}"
+
+
+class LeaseLostError(Exception):
+    pass
+
+
+class Lease:
+    def __init__(self, mongo_client, name: str, token: int, expires_at: datetime):
+        self._coll = mongo_client[common.MONGO_COLL_NAME][LEASES_COLL_NAME]
+        self.name = name
+        # grows with every acquisition, so stale holder can be told apart
+        self.token = token
+        self.expires_at = expires_at
+        self._acquired_at = time.perf_counter()
+
+    @property
+    def hold_sec(self) -> float:
+        return time.perf_counter() - self._acquired_at
+
+    def assert_held(self) -> None:
+        """
+        fencing check, to be done before irreversible side effects
+        """
+        if (
+            self._coll.count_documents(
+                {
+                    "_id": self.name,
+                    "token": self.token,
+                    "expires_at": {"$gt": datetime.now(timezone.utc)},
+                },
+                limit=1,
+            )
+            == 0
+        ):
+            raise LeaseLostError(f"lease {self.name}#{self.token} is lost")
+
+    def release(self) -> None:
+        self._coll.update_one(
+            {"_id": self.name, "token": self.token},
+            {
+                "$set": {
+                    "holder": None,
+                    "expires_at": datetime.now(timezone.utc),
+                    "last_hold_sec": self.hold_sec,
+                }
+            },
+        )
+
+
+def acquire_lease(
+    mongo_client, name: str, ttl: timedelta = DEFAULT_LEASE_TTL
+) -> typing.Optional[Lease]:
+    """
+    one round-trip; returns None if lease is held by someone else and not expired
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        r = mongo_client[common.MONGO_COLL_NAME][LEASES_COLL_NAME].find_one_and_update(
+            {"_id": name, "expires_at": {"$lte": now}},
+            {
+                "$set": {
+                    "holder": HOLDER_ID,
+                    "acquired_at": now,
+                    "expires_at": now + ttl,
+                },
+                "$inc": {"token": 1},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # document exists, but is not expired
+        return None
+    return Lease(mongo_client, name, r["token"], r["expires_at"])
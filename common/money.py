@@ -0,0 +1,342 @@
+"""===============================================================================
+
+        FILE: common/money.py
+
+       USAGE: (not intended to be directly executed)
+
+ DESCRIPTION: parsing and storage of `alex.money` records
+
+     OPTIONS: ---
+REQUIREMENTS: ---
+        BUGS: ---
+       NOTES: ---
+      AUTHOR: Alex Leontiev (alozz1991@gmail.com)
+ORGANIZATION:
+     VERSION: ---
+     CREATED: 2026-10-19T10:12:40.118204
+    REVISION: ---
+
+==============================================================================="""
+import collections
+import csv
+import hashlib
+import re
+import time
+import typing
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+import common
+from common.simple_math_eval import simple_math_eval
+
+MONEY_COLL_NAME = "alex.money"
+MONEY_CATEGORIES_COLL_NAME = "alex.money_categories"
+# one document per (period, key), where period is "day" or "month"
+MONEY_ROLLUPS_COLL_NAME = "alex.money_rollups"
+# used when `alex.money_categories` is empty
+DEFAULT_MONEY_CATEGORIES = ("food", "fun")
+_MONEY_CATEGORIES_TTL_SEC = 300
+
+# amount #category #tag %date comment
+_MONEY_LINE_RE = re.compile(
+    r"^\s*(?P<amount>\S+)(?P<tokens>(?:\s+[#%]\S*)*)(?:\s+(?P<comment>.*?))?\s*$"
+)
+_MONEY_TOKEN_RE = re.compile(r"#(?P<tag>\S+)|%(?P<date>\d{12}|\d{6})\b|%\S*")
+
+
+class MoneyRecord(typing.NamedTuple):
+    amount: float
+    category: str
+    tags: typing.Tuple[str, ...]
+    # local time
+    date: datetime
+    comment: str
+
+    @property
+    def content_hash(self) -> str:
+        return hashlib.sha1(
+            "\t".join(
+                [
+                    self.date.strftime("%Y-%m-%d %H:%M:%S"),
+                    repr(self.amount),
+                    self.category,
+                    ",".join(self.tags),
+                    self.comment,
+                ]
+            ).encode()
+        ).hexdigest()
+
+    def to_mongo(self, is_hashed: bool = True) -> dict:
+        r = {
+            "date": common.to_utc_datetime(self.date),
+            "comment": self.comment,
+            "tags": list(self.tags),
+            "category": self.category,
+            "amount": self.amount,
+        }
+        if is_hashed:
+            r["content_hash"] = self.content_hash
+        return r
+
+    @classmethod
+    def from_mongo(cls, r: dict) -> "MoneyRecord":
+        return cls(
+            amount=r["amount"],
+            category=r["category"],
+            tags=tuple(r.get("tags") or ()),
+            date=common.to_utc_datetime(r["date"], inverse=True),
+            comment=r.get("comment") or "",
+        )
+
+
+_money_categories_cache: dict = {"expires_at": 0.0, "categories": None}
+
+
+def get_money_categories(mongo_client) -> typing.FrozenSet[str]:
+    """
+    categories from `alex.money_categories` (`{"name": ...}` documents), cached for
+    `_MONEY_CATEGORIES_TTL_SEC`
+    """
+    if _money_categories_cache["expires_at"] < time.time():
+        categories = frozenset(
+            r["name"]
+            for r in mongo_client[common.MONGO_COLL_NAME][
+                MONEY_CATEGORIES_COLL_NAME
+            ].find({}, {"name": 1})
+        )
+        _money_categories_cache["categories"] = (
+            categories if categories else frozenset(DEFAULT_MONEY_CATEGORIES)
+        )
+        _money_categories_cache["expires_at"] = time.time() + _MONEY_CATEGORIES_TTL_SEC
+    return _money_categories_cache["categories"]
+
+
+def _parse_token_date(s: str, now: datetime) -> datetime:
+    if len(s) == 12:
+        # %Y%m%d%H%M
+        return datetime(int(s[:4]), int(s[4:6]), int(s[6:8]), int(s[8:10]), int(s[10:]))
+    else:
+        # %d%H%M
+        return datetime(now.year, now.month, int(s[:2]), int(s[2:4]), int(s[4:]))
+
+
+def parse_money_line(
+    line: str,
+    categories: typing.Collection[str],
+    now: typing.Optional[datetime] = None,
+) -> MoneyRecord:
+    if now is None:
+        now = datetime.now()
+    m = _MONEY_LINE_RE.match(line)
+    assert m is not None, f"cannot parse `{line}`"
+
+    amount = simple_math_eval(m.group("amount"))
+    assert amount != 0, "amount==0"
+    tags = set()
+    date = now
+    category = None
+    for t in _MONEY_TOKEN_RE.finditer(m.group("tokens")):
+        if t.group("tag") is not None:
+            if t.group("tag") in categories:
+                category = t.group("tag")
+            else:
+                tags.add(t.group("tag"))
+        elif t.group("date") is not None:
+            date = _parse_token_date(t.group("date"), now)
+    assert category is not None, "no category"
+
+    return MoneyRecord(
+        amount=amount,
+        category=category,
+        tags=tuple(sorted(tags)),
+        date=date,
+        comment=m.group("comment") or "",
+    )
+
+
+def parse_money_text(
+    text: str,
+    categories: typing.Collection[str],
+    now: typing.Optional[datetime] = None,
+) -> typing.List[MoneyRecord]:
+    """
+    one record per non-empty line
+    """
+    return [
+        parse_money_line(line, categories, now=now)
+        for line in text.splitlines()
+        if line.strip()
+    ]
+
+
+def iter_money_csv(
+    f: typing.Iterable[str], categories: typing.Collection[str]
+) -> typing.Iterator[MoneyRecord]:
+    """
+    `f` is CSV with header `date,amount,category,tags,comment`; `date` is local
+    `%Y-%m-%d %H:%M`, `tags` are space-separated
+    """
+    for i, row in enumerate(csv.DictReader(f)):
+        category = row["category"].strip()
+        assert category in categories, f"row {i}: unknown category `{category}`"
+        amount = simple_math_eval(row["amount"])
+        assert amount != 0, f"row {i}: amount==0"
+        yield MoneyRecord(
+            amount=amount,
+            category=category,
+            tags=tuple(sorted(set((row.get("tags") or "").split()))),
+            date=datetime.strptime(row["date"].strip(), "%Y-%m-%d %H:%M"),
+            comment=(row.get("comment") or "").strip(),
+        )
+
+
+def insert_money_records(
+    records: typing.Iterable[MoneyRecord], mongo_client, is_dedup: bool = True
+) -> dict:
+    """
+    with `is_dedup` (for imports), idempotent: records are upserted by content hash,
+    in a single `bulk_write`; otherwise (interactive entries, where two identical
+    lines are two real expenses) plain inserts, without content hash;
+    `alex.money_rollups` are updated for newly inserted records, which are returned
+    under `records`
+    """
+    records = list(records)
+    if not records:
+        return {"total": 0, "inserted": 0, "records": []}
+    coll = mongo_client[common.MONGO_COLL_NAME][MONEY_COLL_NAME]
+    if is_dedup:
+        result = coll.bulk_write(
+            [
+                UpdateOne(
+                    {"content_hash": r.content_hash},
+                    {"$setOnInsert": r.to_mongo()},
+                    upsert=True,
+                )
+                for r in records
+            ],
+            ordered=False,
+        )
+        # only records which were actually inserted (and not deduplicated) count
+        inserted = [records[i] for i in sorted(result.upserted_ids)]
+    else:
+        coll.insert_many([r.to_mongo(is_hashed=False) for r in records])
+        inserted = records
+    _update_money_rollups(inserted, mongo_client)
+    return {"total": len(records), "inserted": len(inserted), "records": inserted}
+
+
+def _rollup_field(s: str) -> str:
+    return s.replace(".", "_").replace("$", "_")
+
+
+def _money_rollup_operations(
+    records: typing.Iterable[MoneyRecord],
+) -> typing.List[UpdateOne]:
+    incs = collections.defaultdict(collections.Counter)
+    for r in records:
+        month = r.date.strftime("%Y-%m")
+        inc = {
+            "total": r.amount,
+            "count": 1,
+            f"by_category.{_rollup_field(r.category)}": r.amount,
+            **{f"by_tag.{_rollup_field(tag)}": r.amount for tag in r.tags},
+        }
+        for period, key in [("day", r.date.strftime("%Y-%m-%d")), ("month", month)]:
+            incs[(period, key, month)].update(inc)
+    return [
+        UpdateOne(
+            {"period": period, "key": key},
+            {"$inc": dict(inc), "$set": {"month": month}},
+            upsert=True,
+        )
+        for (period, key, month), inc in incs.items()
+    ]
+
+
+def _update_money_rollups(records: typing.Iterable[MoneyRecord], mongo_client) -> None:
+    operations = _money_rollup_operations(records)
+    if operations:
+        mongo_client[common.MONGO_COLL_NAME][MONEY_ROLLUPS_COLL_NAME].bulk_write(
+            operations, ordered=False
+        )
+
+
+def rebuild_money_rollups(mongo_client) -> int:
+    """
+    batch backfill: recomputes `alex.money_rollups` from the whole `alex.money`
+    """
+    coll = mongo_client[common.MONGO_COLL_NAME][MONEY_COLL_NAME]
+    operations = _money_rollup_operations(
+        MoneyRecord.from_mongo(r)
+        for r in coll.find(
+            {}, {k: 1 for k in ["date", "amount", "category", "tags", "comment"]}
+        )
+    )
+    rollups_coll = mongo_client[common.MONGO_COLL_NAME][MONEY_ROLLUPS_COLL_NAME]
+    rollups_coll.delete_many({})
+    if operations:
+        rollups_coll.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def get_money_report(mongo_client, month: typing.Optional[str] = None) -> str:
+    """
+    `month` is `%Y-%m` (current month by default); answered from rollups only
+    """
+    if month is None:
+        month = datetime.now().strftime("%Y-%m")
+    docs = list(
+        mongo_client[common.MONGO_COLL_NAME][MONEY_ROLLUPS_COLL_NAME].find(
+            {"month": month}
+        )
+    )
+    month_docs = [r for r in docs if r["period"] == "month"]
+    if not month_docs:
+        return f"no records for {month}"
+    (month_doc,) = month_docs
+
+    lines = [f"{month}: {month_doc['total']} ({month_doc['count']} records)"]
+    for title, k in [("by category", "by_category"), ("by tag", "by_tag")]:
+        if month_doc.get(k):
+            lines.append(f"{title}:")
+            lines.extend(
+                f"  {name} {amount}"
+                for name, amount in sorted(
+                    month_doc[k].items(), key=lambda kv: kv[1], reverse=True
+                )
+            )
+    lines.append("by day:")
+    lines.extend(
+        f"  {r['key']} {r['total']}"
+        for r in sorted(docs, key=lambda r: r["key"])
+        if r["period"] == "day"
+    )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python3 -m common.money --help
+    import click
+    from pymongo import MongoClient
+
+    @click.group()
+    @click.option("--mongo-url", required=True, envvar="MONGO_URL", show_envvar=True)
+    @click.pass_context
+    def money(ctx, mongo_url):
+        ctx.obj = MongoClient(mongo_url)
+
+    @money.command()
+    @click.pass_obj
+    def rebuild_rollups(mongo_client):
+        click.echo(f"{rebuild_money_rollups(mongo_client)} rollups written")
+
+    @money.command()
+    @click.argument("csv_file", type=click.File())
+    @click.pass_obj
+    def import_csv(mongo_client, csv_file):
+        categories = get_money_categories(mongo_client)
+        res = insert_money_records(iter_money_csv(csv_file, categories), mongo_client)
+        click.echo(f"imported {res['inserted']} of {res['total']} records")
+
+    money()
@@ -19,71 +19,107 @@ ORGANIZATION:
 
 ==============================================================================="""
 # from math import floor, trunc
+import functools
 import logging
 import ast
 import operator as op
 import re
-from common import get_configured_logger
 import typing
 
+_logger = logging.getLogger("simple_math_eval")
+
+_TOKEN_RE = re.compile(r"\d+(?:\.\d*)?|\.\d+|[-+*/()]")
+_PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2}
+# unary minus in compiled form (cannot clash with number literals)
+_NEG = "neg"
+
+
+def _compile_expr(tokens: list, pos: int, min_prec: int, rpn: list) -> int:
+    """
+    precedence climbing; appends postfix form of expression to `rpn`,
+    returns position of first unconsumed token
+    """
+    pos = _compile_atom(tokens, pos, rpn)
+    while (
+        pos < len(tokens)
+        and tokens[pos] in _PRECEDENCE
+        and _PRECEDENCE[tokens[pos]] >= min_prec
+    ):
+        op_ = tokens[pos]
+        pos = _compile_expr(tokens, pos + 1, _PRECEDENCE[op_] + 1, rpn)
+        rpn.append(op_)
+    return pos
+
+
+def _compile_atom(tokens: list, pos: int, rpn: list) -> int:
+    if pos >= len(tokens):
+        raise ValueError("unexpected end of expression")
+    tok = tokens[pos]
+    if tok == "(":
+        pos = _compile_expr(tokens, pos + 1, 1, rpn)
+        if pos >= len(tokens) or tokens[pos] != ")":
+            raise ValueError("unbalanced parentheses")
+        return pos + 1
+    elif tok in "+-":
+        pos = _compile_atom(tokens, pos + 1, rpn)
+        if tok == "-":
+            rpn.append(_NEG)
+        return pos
+    elif tok in _PRECEDENCE or tok == ")":
+        raise ValueError(f"unexpected `{tok}` at position {pos}")
+    else:
+        rpn.append(tok)
+        return pos + 1
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(s: str) -> tuple:
+    """
+    returns postfix form of `s`: number literals (as strings) and operators
+    """
+    tokens = _TOKEN_RE.findall(s)
+    if len(tokens) == 0:
+        raise ValueError(f"no expression in `{s}`")
+    rpn = []
+    pos = _compile_expr(tokens, 0, 1, rpn)
+    if pos != len(tokens):
+        raise ValueError(f"unexpected `{tokens[pos]}` at position {pos}")
+    return tuple(rpn)
+
 
 def simple_math_eval(
     s: str,
     number_utils: (typing.Callable, typing.Callable) = (float, float),
     is_verbose: bool = False,
 ) -> float:
-    s = re.findall(r"[0-9.\.]+|[+*/-]", s)
-    s = list(s[::-1])
+    """
+    evaluates `+-*/` expression with parentheses and unary minus;
+    characters other than digits, `.` and operators are ignored
+    """
+    rpn = _compile(s)
     string_to_num, float_to_num = number_utils
-    logger = get_configured_logger(
-        "simple_math_eval", level="DEBUG" if is_verbose else "WARNING"
-    )
-    logger.debug(s)
-
-    # FIXME: this is a hotfix, ideally, the logic below should do it
-    assert len(s) > 0
-    if len(s) == 1:
-        return string_to_num(s[0])
-
-    def get_value():
-        _logger = get_configured_logger(
-            "get_value", level="DEBUG" if is_verbose else "WARNING"
-        )
-        sign = 1
-        if s and s[-1] == "-":
-            s.pop()
-            sign = -1
-        value = 0
-        while s and s[-1].isdigit():
-            value *= 10
-            value += string_to_num(s.pop())
-        _logger.debug((sign, value))
-        return sign * value
-
-    def get_term():
-        _logger = get_configured_logger(
-            "get_term", level="DEBUG" if is_verbose else "WARNING"
-        )
-        term = get_value()
-        _logger.debug(f"term: {term}")
-        while s and s[-1] in "*/":
-            op = s.pop()
-            value = get_value()
-            if op == "*":
-                term *= value
+
+    stack = []
+    for tok in rpn:
+        if tok == _NEG:
+            stack[-1] = -stack[-1]
+        elif tok in _PRECEDENCE:
+            value = stack.pop()
+            term = stack[-1]
+            if tok == "+":
+                stack[-1] = term + value
+            elif tok == "-":
+                stack[-1] = term - value
+            elif tok == "*":
+                stack[-1] = term * value
             else:
-                term = float_to_num(1.0 * term / value)
-        return term
-
-    ans = get_term()
-    logger.debug(f"ans: {ans}")
-    while s:
-        op, term = s.pop(), get_term()
-        logger.debug((ans, op, term))
-        if op == "+":
-            ans += term
+                stack[-1] = float_to_num(1.0 * term / value)
         else:
-            ans -= term
+            stack.append(string_to_num(tok))
+    (ans,) = stack
+
+    if is_verbose:
+        _logger.info(f"{s} => {rpn} => {ans}")
     return ans
 
 
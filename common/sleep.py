@@ -0,0 +1,157 @@
+"""===============================================================================
+
+        FILE: common/sleep.py
+
+       USAGE: (not intended to be directly executed)
+
+ DESCRIPTION: sleep analytics over `alex.sleepingtimes`
+
+     OPTIONS: ---
+REQUIREMENTS: ---
+        BUGS: ---
+       NOTES: ---
+      AUTHOR: Alex Leontiev (alozz1991@gmail.com)
+ORGANIZATION:
+     VERSION: ---
+     CREATED: 2026-10-19T11:40:03.871266
+    REVISION: ---
+
+==============================================================================="""
+import re
+import typing
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+import common
+
+SLEEPING_TIMES_COLL_NAME = "alex.sleepingtimes"
+_BACKFILL_BATCH_SIZE = 1000
+
+
+def parse_stats_range(s: typing.Optional[str]) -> timedelta:
+    """
+    `<n>d` or `<n>w`, 30 days by default
+    """
+    if not s:
+        return timedelta(days=30)
+    m = re.fullmatch(r"(\d+)([dw])", s.strip())
+    assert m is not None, f"cannot parse range `{s}` (expected e.g. `30d` or `4w`)"
+    return timedelta(**{{"d": "days", "w": "weeks"}[m.group(2)]: int(m.group(1))})
+
+
+def get_sleep_stats(mongo_client, since: datetime) -> dict:
+    """
+    `since` is UTC; aggregation is done server-side over records having `duration_sec`
+    """
+    (res,) = mongo_client[common.MONGO_COLL_NAME][SLEEPING_TIMES_COLL_NAME].aggregate(
+        [
+            {
+                "$match": {
+                    "startsleep": {"$gte": since},
+                    "duration_sec": {"$exists": True},
+                }
+            },
+            {
+                "$facet": {
+                    "by_category": [
+                        {
+                            "$group": {
+                                "_id": "$category",
+                                "count": {"$sum": 1},
+                                "total_sec": {"$sum": "$duration_sec"},
+                                "avg_sec": {"$avg": "$duration_sec"},
+                            }
+                        },
+                        {"$sort": {"total_sec": -1}},
+                    ],
+                    "by_week": [
+                        {
+                            "$group": {
+                                "_id": {
+                                    "$dateToString": {
+                                        "format": "%Y-%U",
+                                        "date": "$startsleep",
+                                    }
+                                },
+                                "count": {"$sum": 1},
+                                "avg_sec": {"$avg": "$duration_sec"},
+                            }
+                        },
+                        {"$sort": {"_id": 1}},
+                    ],
+                }
+            },
+        ]
+    )
+    return res
+
+
+def format_sleep_stats(stats: dict) -> str:
+    def _td(sec) -> str:
+        return str(timedelta(seconds=round(sec)))
+
+    if not stats["by_category"]:
+        return "no sleep records"
+    lines = ["by category:"]
+    lines.extend(
+        f"  {r['_id']}: {r['count']} times, total {_td(r['total_sec'])}, avg {_td(r['avg_sec'])}"
+        for r in stats["by_category"]
+    )
+    lines.append("avg by week:")
+    lines.extend(
+        f"  {r['_id']}: {_td(r['avg_sec'])} ({r['count']} times)"
+        for r in stats["by_week"]
+    )
+    return "\n".join(lines)
+
+
+def backfill_sleep_durations(mongo_client) -> int:
+    """
+    one-time: sets `duration_sec` of finished records which do not have it
+    """
+    coll = mongo_client[common.MONGO_COLL_NAME][SLEEPING_TIMES_COLL_NAME]
+    cursor = coll.find(
+        {"endsleep": {"$ne": None}, "duration_sec": {"$exists": False}},
+        {"startsleep": 1, "endsleep": 1},
+        batch_size=_BACKFILL_BATCH_SIZE,
+    )
+    modified_count, operations = 0, []
+    for r in cursor:
+        operations.append(
+            UpdateOne(
+                {"_id": r["_id"]},
+                {
+                    "$set": {
+                        "duration_sec": (
+                            r["endsleep"] - r["startsleep"]
+                        ).total_seconds()
+                    }
+                },
+            )
+        )
+        if len(operations) >= _BACKFILL_BATCH_SIZE:
+            modified_count += coll.bulk_write(operations).modified_count
+            operations = []
+    if operations:
+        modified_count += coll.bulk_write(operations).modified_count
+    return modified_count
+
+
+if __name__ == "__main__":
+    # python3 -m common.sleep --help
+    import click
+    from pymongo import MongoClient
+
+    @click.group()
+    @click.option("--mongo-url", required=True, envvar="MONGO_URL", show_envvar=True)
+    @click.pass_context
+    def sleep(ctx, mongo_url):
+        ctx.obj = MongoClient(mongo_url)
+
+    @sleep.command()
+    @click.pass_obj
+    def backfill_durations(mongo_client):
+        click.echo(f"{backfill_sleep_durations(mongo_client)} records updated")
+
+    sleep()
@@ -0,0 +1,149 @@
+"""===============================================================================
+
+        FILE: common/time_report.py
+
+       USAGE: (not intended to be directly executed)
+
+ DESCRIPTION: time-tracking analytics over `alex.time`
+
+     OPTIONS: ---
+REQUIREMENTS: ---
+        BUGS: ---
+       NOTES: ---
+      AUTHOR: Alex Leontiev (alozz1991@gmail.com)
+ORGANIZATION:
+     VERSION: ---
+     CREATED: 2026-10-19T11:02:17.540913
+    REVISION: ---
+
+==============================================================================="""
+import typing
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+import common
+
+TIME_COLL_NAME = "alex.time"
+# per-day stats of closed (past) days, keyed by `day` (`%Y-%m-%d`)
+TIME_DAILY_STATS_COLL_NAME = "alex.time_daily_stats"
+# heartbeat runs every 30 minutes, see `docs/infra-creation-diary.md`
+TIME_SLOT = timedelta(minutes=30)
+# late slots (e.g. 23:30 answered after midnight, or imputed by the next heartbeat)
+# still change yesterday, so only days before it are cached
+_CACHE_HORIZON = timedelta(days=1)
+
+
+def compute_day_stats(mongo_client, day: date) -> dict:
+    """
+    hours per category and number of missing heartbeat slots for the (local) `day`
+    """
+    start = datetime(day.year, day.month, day.day)
+    df = pd.DataFrame(
+        mongo_client[common.MONGO_COLL_NAME][TIME_COLL_NAME].find(
+            {
+                "date": {
+                    "$gte": common.to_utc_datetime(start),
+                    "$lt": common.to_utc_datetime(start + timedelta(days=1)),
+                }
+            },
+            {"_id": 0, "date": 1, "category": 1},
+        ),
+        columns=["date", "category"],
+    )
+    slot_hours = TIME_SLOT.total_seconds() / 3600
+    hours = (
+        df["category"].dropna().value_counts().mul(slot_hours).to_dict()
+        if len(df) > 0
+        else {}
+    )
+    missing_slots = (
+        len(common.fill_gaps(df["date"].dt.to_pydatetime().tolist(), TIME_SLOT))
+        if len(df) > 0
+        else 0
+    )
+    return {
+        "day": day.strftime("%Y-%m-%d"),
+        "hours": {k: float(v) for k, v in hours.items()},
+        "slots": len(df),
+        "unanswered_slots": int(df["category"].isna().sum()) if len(df) > 0 else 0,
+        "missing_slots": missing_slots,
+    }
+
+
+def get_day_stats(mongo_client, day: date, today: typing.Optional[date] = None) -> dict:
+    """
+    days before `_CACHE_HORIZON` are computed once and cached in
+    `alex.time_daily_stats` (see `invalidate_day_stats`); recent days are
+    always recomputed
+    """
+    if today is None:
+        today = datetime.now().date()
+    if day >= today - _CACHE_HORIZON:
+        return compute_day_stats(mongo_client, day)
+
+    cache_coll = mongo_client[common.MONGO_COLL_NAME][TIME_DAILY_STATS_COLL_NAME]
+    stats = cache_coll.find_one({"day": day.strftime("%Y-%m-%d")}, {"_id": 0})
+    if stats is None:
+        stats = compute_day_stats(mongo_client, day)
+        cache_coll.replace_one({"day": stats["day"]}, stats, upsert=True)
+    return stats
+
+
+def invalidate_day_stats(
+    mongo_client,
+    since: typing.Optional[datetime],
+    until: typing.Optional[datetime] = None,
+) -> None:
+    """
+    drops cached stats of the (local) days between `since` and `until` (UTC, as in
+    `alex.time`; `until` defaults to `since`), or of all days if `since` is None;
+    to be called after `alex.time` records are modified
+    """
+    cache_coll = mongo_client[common.MONGO_COLL_NAME][TIME_DAILY_STATS_COLL_NAME]
+    if since is None:
+        cache_coll.delete_many({})
+        return
+    day = common.to_utc_datetime(since, inverse=True).date()
+    last_day = common.to_utc_datetime(
+        since if until is None else until, inverse=True
+    ).date()
+    days = []
+    while day <= last_day:
+        days.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    if days:
+        cache_coll.delete_many({"day": {"$in": days}})
+
+
+def get_time_report(mongo_client, days: int = 7) -> str:
+    today = datetime.now().date()
+    daily = [
+        get_day_stats(mongo_client, today - timedelta(days=i), today=today)
+        for i in reversed(range(days))
+    ]
+
+    df = pd.DataFrame([d["hours"] for d in daily], index=[d["day"] for d in daily])
+    lines = [f"last {days} days:"]
+    if df.empty:
+        lines.append("  no records")
+    else:
+        totals = df.sum().sort_values(ascending=False)
+        for cat, total in totals.items():
+            # streaks: consecutive days where category was present
+            active_days = [
+                datetime.strptime(day, "%Y-%m-%d")
+                for day in df.index[df[cat].fillna(0) > 0]
+            ]
+            periods = common.consecutive_periods(
+                active_days, timedelta(days=1), is_normalize=False
+            )
+            longest_streak = max((p["end"] - p["start"]).days + 1 for p in periods)
+            lines.append(f"  {cat}: {total:.1f}h (longest streak {longest_streak}d)")
+    lines.append(
+        "unanswered slots: {}, missing slots: {}".format(
+            sum(d["unanswered_slots"] for d in daily),
+            sum(d["missing_slots"] for d in daily),
+        )
+    )
+    return "\n".join(lines)
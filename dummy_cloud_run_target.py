@@ -0,0 +1,35 @@
+# dummy_cloud_run_target.py
+"""
+local stand-in for long-running `/call` targets
+
+run: uvicorn dummy_cloud_run_target:app --port 8081
+
+the text of the payload is `<seconds> [fail]`: sleep for given number of seconds
+and (optionally) respond with HTTP 500
+"""
+import asyncio
+import logging
+
+from fastapi import FastAPI, Request, Response
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+app = FastAPI()
+
+
+@app.post("/")
+async def run(request: Request):
+    try:
+        payload = await request.json()
+    except Exception:
+        payload = {}
+    text = (payload.get("message", {}).get("text") or "").strip()
+    logging.info(f"text: `{text}`")
+
+    seconds, *flags = text.split() if text else ["0"]
+    await asyncio.sleep(float(seconds))
+
+    if "fail" in flags:
+        return Response(content="failed on request", status_code=500)
+    return "OK"
@@ -0,0 +1,92 @@
+# gemini_memory_benchmark.py
+"""
+prompt size and latency vs conversation length, for `app.ConversationMemory`
+and for naive full history, both against the fake Gemini model
+
+run: python3 gemini_memory_benchmark.py --turns 200 --budget 2000
+"""
+import asyncio
+import os
+import random
+import time
+
+import click
+
+_WORDS = (
+    "the quick brown fox jumps over lazy dog while cats sleep in warm sun "
+    "and birds sing about weather plans meetings deadlines coffee trains"
+).split()
+
+
+def _make_prompt(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+async def _run(app, strategy: str, turns: int, words: int, seed: int) -> list:
+    rng = random.Random(seed)
+    memory = app.ConversationMemory(app.GEMINI_MEMORY_TOKEN_BUDGET)
+    history, res = [], []
+    for i in range(turns):
+        prompt = _make_prompt(rng, words)
+        if strategy == "memory":
+            state = await memory.load(0)
+            contents = memory.contents(state, prompt)
+        else:
+            contents = history + [{"role": "user", "parts": [prompt]}]
+        start_time = time.perf_counter()
+        text = await app.generate_reply(contents)
+        latency_sec = time.perf_counter() - start_time
+        if strategy == "memory":
+            # includes (occasional) summarization
+            await memory.append(0, state, prompt, text)
+        else:
+            history.extend(
+                [
+                    {"role": "user", "parts": [prompt]},
+                    {"role": "model", "parts": [text]},
+                ]
+            )
+        res.append((i + 1, app.estimate_tokens(contents), latency_sec))
+    return res
+
+
+@click.command()
+@click.option("-t", "--turns", type=int, default=200, show_default=True)
+@click.option("-b", "--budget", type=int, default=2000, show_default=True)
+@click.option("-w", "--words", type=int, default=40, help="words per user message")
+@click.option("--latency-sec", type=float, default=0.01, show_default=True)
+@click.option("--latency-per-token-sec", type=float, default=1e-5, show_default=True)
+@click.option("--every", type=int, default=20, help="report every N turns")
+@click.option("--seed", type=int, default=42, show_default=True)
+def gemini_memory_benchmark(
+    turns, budget, words, latency_sec, latency_per_token_sec, every, seed
+):
+    # read by `app` at import time
+    os.environ.update(
+        GEMINI_MODEL="fake",
+        GEMINI_CACHE="0",
+        GEMINI_MEMORY_TOKEN_BUDGET=str(budget),
+        FAKE_GEMINI_LATENCY_SEC=str(latency_sec),
+        FAKE_GEMINI_LATENCY_PER_TOKEN_SEC=str(latency_per_token_sec),
+    )
+    import app
+
+    results = {
+        strategy: asyncio.run(_run(app, strategy, turns, words, seed))
+        for strategy in ["full", "memory"]
+    }
+    click.echo(
+        f"{'turn':>6} {'full tokens':>12} {'full sec':>9} {'memory tokens':>14} {'memory sec':>11}"
+    )
+    for (turn, full_tokens, full_sec), (_, memory_tokens, memory_sec) in zip(
+        results["full"], results["memory"]
+    ):
+        if turn % every == 0 or turn == 1:
+            click.echo(
+                f"{turn:>6} {full_tokens:>12} {full_sec:>9.3f} {memory_tokens:>14} {memory_sec:>11.3f}"
+            )
+    click.echo(f"summarizations: {app.GEMINI_METRICS['memory_summarizations']}")
+
+
+if __name__ == "__main__":
+    gemini_memory_benchmark()
@@ -1,6 +1,10 @@
 # habits.py
 import os
+import copy
+import functools
 import logging
+import time
+import typing
 from datetime import datetime, timedelta
 from telegram import Bot  # Keep this import
 from pymongo import MongoClient, UpdateOne
@@ -9,43 +13,139 @@ from croniter import croniter
 import pytz
 import asyncio  # <-- Add asyncio import
 
-from common import MONGO_COLL_NAME, TimerContextManager, TARGET_TIMEZONE
+from common import (
+    MONGO_COLL_NAME,
+    TimerContextManager,
+    TARGET_TIMEZONE,
+    get_current_state,
+    update_current_state,
+)
+from common.indexes import get_docs_examined
+
+
+@functools.lru_cache(maxsize=None)
+def _get_cron_schedule(cronline: str) -> croniter:
+    """
+    parsed once per cronline; use copies (`croniter` is stateful)
+    """
+    return croniter(cronline)
+
+
+def _expand_occurrences(
+    cronline: str, base: datetime, until: datetime, include_base: bool
+) -> typing.Tuple[typing.List[datetime], datetime]:
+    """
+    returns occurrences in `(base, until]` (`[base, until]` if `include_base`)
+    and the first occurrence after `until`
+    """
+    it = copy.copy(_get_cron_schedule(cronline))
+    it.set_current(base)
+    res = [base] if include_base else []
+    while (dt := it.get_next(datetime)) <= until:
+        res.append(dt)
+    return res, dt
+
+
+def _as_utc(dt: datetime) -> datetime:
+    # Mongo returns naive UTC datetimes
+    return pytz.utc.localize(dt) if dt.tzinfo is None else dt.astimezone(pytz.utc)
+
+
+def set_habit_cronline(
+    mongo_client, name: str, cronline: str, now: typing.Optional[datetime] = None
+) -> typing.Optional[datetime]:
+    """
+    edits `cronline` of a habit together with its `next_due` (`HabitsJob` only
+    looks at `next_due`, so the two must be changed at once); `next_due` of the
+    old cronline is replaced by the first occurrence of the new one after it if
+    it is overdue, or after `now` otherwise; returns the new `next_due`
+    """
+    if not croniter.is_valid(cronline):
+        raise ValueError(f"invalid cronline {cronline!r}")
+    habits_coll = mongo_client[MONGO_COLL_NAME]["alex.habits"]
+    habit = habits_coll.find_one({"name": name})
+    if habit is None:
+        raise KeyError(name)
+    now_utc = datetime.now(pytz.utc) if now is None else now.astimezone(pytz.utc)
+    next_due = None
+    if habit.get("next_due") is not None:
+        target_tz = pytz.timezone(TARGET_TIMEZONE)
+        base_utc = min(_as_utc(habit["next_due"]), now_utc)
+        base_target_naive = base_utc.astimezone(target_tz).replace(tzinfo=None)
+        _, next_due_target_naive = _expand_occurrences(
+            cronline, base_target_naive, base_target_naive, include_base=False
+        )
+        next_due = target_tz.localize(next_due_target_naive).astimezone(pytz.utc)
+    # without `next_due`, the job schedules the habit from its anchor date
+    habits_coll.update_one(
+        {"_id": habit["_id"]},
+        {"$set": {"cronline": cronline, "next_due": next_due}},
+    )
+    return next_due
 
 
 class HabitsJob:
-    def __init__(self):
-        self._token = os.environ["TELEGRAM_TOKEN"]
+    def __init__(self, mongo_client=None, bot=None, is_explain=False):
+        """
+        `is_explain` adds docs examined by the sweep to its stats (costs a query)
+        """
         self._chat_id = os.environ["CHAT_ID"]
-        self._mongo_url = os.environ["MONGO_URL"]
-        self._bot = Bot(token=self._token)
-        self._mongo_client = MongoClient(self._mongo_url)
+        # shared clients can be given, see `scheduled_jobs.py`
+        if bot is None:
+            bot = Bot(token=os.environ["TELEGRAM_TOKEN"])
+        if mongo_client is None:
+            mongo_client = MongoClient(os.environ["MONGO_URL"])
+        self._bot = bot
+        self._mongo_client = mongo_client
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._is_explain = is_explain
+        self.last_sweep_stats = None
         self._habits_punch_coll = self._mongo_client[MONGO_COLL_NAME][
             "alex.habitspunch2"
         ]
 
     # <-- CHANGED: Mark run() as an async function
-    async def run(self):
+    async def run(self, lease=None, now=None):
         # ... (all the logic to calculate habits remains the same) ...
-        _now_utc = datetime.now(pytz.utc)
+        # `now` (tz-aware) is for simulations, see `habits_benchmark.py`
+        _now_utc = datetime.now(pytz.utc) if now is None else now.astimezone(pytz.utc)
         target_tz = pytz.timezone(TARGET_TIMEZONE)
         self._logger.info(f"Habits job running at {_now_utc.isoformat()} UTC")
 
         # [ The entire block of code for calculating 'punches_to_create' is unchanged ]
 
         habits_coll = self._mongo_client[MONGO_COLL_NAME]["alex.habits"]
-        habits_df = pd.DataFrame(list(habits_coll.find({"enabled": True})))
-        anchor_dates = self._get_anchor_dates()
+        # only habits which are due (or have no `next_due` yet), via index
+        due_habits = list(
+            habits_coll.find(
+                {
+                    "enabled": True,
+                    "$or": [{"next_due": {"$lte": _now_utc}}, {"next_due": None}],
+                }
+            )
+        )
+        anchor_dates = (
+            self._get_anchor_dates()
+            if any(habit.get("next_due") is None for habit in due_habits)
+            else {}
+        )
         punches_to_create = []
+        next_due_updates = []
         default_base_utc = datetime(2021, 12, 14, tzinfo=pytz.utc)
         utc_tz = pytz.utc
-        for habit in habits_df.to_dict(orient="records"):
-            base_utc = anchor_dates.get(habit["name"], default_base_utc)
+        now_target_naive = _now_utc.astimezone(target_tz).replace(tzinfo=None)
+        for habit in due_habits:
+            if habit.get("next_due") is None:
+                base_utc = anchor_dates.get(habit["name"], default_base_utc)
+                include_base = False
+            else:
+                base_utc = _as_utc(habit["next_due"])
+                include_base = True
             base_target_naive = base_utc.astimezone(target_tz).replace(tzinfo=None)
-            it = croniter(habit["cronline"], base_target_naive)
-            while (
-                due_date_target_naive := it.get_next(datetime)
-            ) <= _now_utc.astimezone(target_tz).replace(tzinfo=None):
+            due_dates_target_naive, next_due_target_naive = _expand_occurrences(
+                habit["cronline"], base_target_naive, now_target_naive, include_base
+            )
+            for due_date_target_naive in due_dates_target_naive:
                 due_date_utc = target_tz.localize(due_date_target_naive).astimezone(
                     utc_tz
                 )
@@ -59,8 +159,23 @@ class HabitsJob:
                         "info": habit.get("info"),
                     }
                 )
+            next_due_updates.append(
+                UpdateOne(
+                    {"_id": habit["_id"]},
+                    {
+                        "$set": {
+                            "next_due": target_tz.localize(
+                                next_due_target_naive
+                            ).astimezone(utc_tz)
+                        }
+                    },
+                )
+            )
 
         self._logger.info(f"{len(punches_to_create)} punches")
+        if lease is not None:
+            # fencing: do not write punches if other instance took over
+            lease.assert_held()
         if punches_to_create:
             with TimerContextManager("bulk_write habits"):
                 operations = [
@@ -85,10 +200,17 @@ class HabitsJob:
                 # <-- CHANGED: Use 'await' to call the async function
                 await self._send_message(message, parse_mode="Markdown")
 
-            self._update_anchor_dates(habits_df["name"].unique(), _now_utc)
+            self._update_anchor_dates(
+                sorted({habit["name"] for habit in due_habits}), _now_utc
+            )
+        if next_due_updates:
+            habits_coll.bulk_write(next_due_updates, ordered=False)
 
         with TimerContextManager("sanitize mongo"):
-            self._sanitize_mongo(_now_utc)
+            self.last_sweep_stats = self._sanitize_mongo(
+                _now_utc,
+                min((p["due"] for p in punches_to_create), default=None),
+            )
 
     # ... (the other synchronous methods are unchanged) ...
     def _get_anchor_dates(self):
@@ -106,14 +228,47 @@ class HabitsJob:
         if operations:
             anchor_coll.bulk_write(operations)
 
-    def _sanitize_mongo(self, now_time):
-        # ...
+    def _sanitize_mongo(self, now_time, min_new_due=None) -> dict:
+        """
+        marks overdue unresolved punches as FAILED, looking only at punches due since
+        the previous sweep (its high-water mark is kept in current state document),
+        or at the new punches which are due earlier
+        """
+        start_time = time.perf_counter()
+        hwm = get_current_state(self._mongo_client, use_cache=False).get(
+            "habits_sweep_hwm"
+        )
+        window_start = None if hwm is None else _as_utc(hwm)
+        if window_start is not None and min_new_due is not None:
+            window_start = min(window_start, min_new_due)
+        due_filter = {"$lt": now_time}
+        if window_start is not None:
+            due_filter["$gte"] = window_start
+        query = {"due": due_filter, "status": {"$exists": False}}
+        examined = (
+            get_docs_examined(self._habits_punch_coll, query)
+            if self._is_explain
+            else None
+        )
         result = self._habits_punch_coll.update_many(
-            {"due": {"$lt": now_time}, "status": {"$exists": False}},
-            {"$set": {"status": "FAILED"}},
+            query, {"$set": {"status": "FAILED"}}
         )
+        update_current_state(
+            self._mongo_client, {"$set": {"habits_sweep_hwm": now_time}}
+        )
+        stats = {
+            "window_start": window_start,
+            "window_end": now_time,
+            "matched": result.matched_count,
+            # `totalDocsExamined` (only with `is_explain`)
+            "examined": examined,
+            "modified": result.modified_count,
+            "elapsed_sec": time.perf_counter() - start_time,
+        }
         if result.modified_count > 0:
             self._logger.info(f"Marked {result.modified_count} habits as FAILED.")
+        self._logger.info(f"sweep: {stats}")
+        return stats
 
     # <-- CHANGED: Mark _send_message as an async function and use 'await'
     async def _send_message(self, text, limit: int = 4000, **kwargs):
@@ -126,3 +281,20 @@ class HabitsJob:
                     chat_id=self._chat_id,
                     text=text[a : a + limit],
                 )
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--mongo-url", required=True, envvar="MONGO_URL", show_envvar=True)
+    @click.argument("name")
+    @click.argument("cronline")
+    def set_cronline(mongo_url, name, cronline):
+        """
+        edits cronline of habit NAME (recomputes its `next_due`)
+        """
+        next_due = set_habit_cronline(MongoClient(mongo_url), name, cronline)
+        click.echo(f"{name}: {cronline!r}, next due {next_due}")
+
+    set_cronline()
@@ -0,0 +1,200 @@
+# habits_benchmark.py
+"""
+simulation harness for `HabitsJob`: N synthetic habits, fake bot, virtual clock
+
+run: python3 habits_benchmark.py --habits 10000 --days 1
+
+uses `mongomock` (`pip install -r requirements-dev.txt`) by default, or a local
+stand-in `mongod` given by `--mongo-url` (its `logistics` habits collections are dropped!)
+"""
+import asyncio
+import collections
+import logging
+import os
+import random
+import time
+import tracemalloc
+import typing
+from datetime import datetime, timedelta, timezone
+
+import click
+
+# `HabitsJob` reads it at construction time
+os.environ.setdefault("CHAT_ID", "0")
+
+from habits import HabitsJob
+from common import MONGO_COLL_NAME, CURRENT_STATE_COLL_NAME
+
+_CRONLINES = [
+    "0 9 * * *",
+    "30 8 * * 1-5",
+    "0 21 * * 0",
+    "15 7,19 * * *",
+    "0 */2 * * *",
+    "*/30 * * * *",
+]
+_HABITS_COLLS = ["alex.habits", "alex.habits_anchors", "alex.habitspunch2"]
+_LOCAL_URL_PREFIXES = ("mongodb://localhost", "mongodb://127.0.0.1")
+
+
+class _CountingCollection:
+    def __init__(self, coll, counter: collections.Counter):
+        self._coll = coll
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._coll, name)
+        if not callable(attr):
+            return attr
+
+        def _wrapped(*args, **kwargs):
+            self._counter[f"{self._coll.name}.{name}"] += 1
+            if name == "bulk_write":
+                self._counter[f"{self._coll.name}.bulk_write(ops)"] += len(args[0])
+            return attr(*args, **kwargs)
+
+        return _wrapped
+
+
+class _CountingClient:
+    """
+    counts collection method calls (i.e. round-trips, modulo cursor batches)
+    """
+
+    def __init__(self, mongo_client):
+        self._mongo_client = mongo_client
+        self.counter = collections.Counter()
+
+    def __getitem__(self, database):
+        client = self
+
+        class _Database:
+            def __getitem__(self, collection):
+                return _CountingCollection(
+                    client._mongo_client[database][collection], client.counter
+                )
+
+        return _Database()
+
+
+class _FakeBot:
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages += 1
+        self.bytes += len(text)
+
+
+def _make_habits(n: int, rng: random.Random) -> typing.List[dict]:
+    return [
+        {
+            "name": f"habit-{i:05d}",
+            "cronline": rng.choice(_CRONLINES),
+            "enabled": rng.random() > 0.05,
+            "delaymin": rng.choice([0, 30, 60, 120]),
+            "info": f"synthetic habit #{i}",
+        }
+        for i in range(n)
+    ]
+
+
+async def _simulate(
+    mongo_client, habits: int, days: float, step_min: int, seed: int, is_explain: bool
+) -> dict:
+    db = mongo_client[MONGO_COLL_NAME]
+    for coll_name in [*_HABITS_COLLS, CURRENT_STATE_COLL_NAME]:
+        db[coll_name].drop()
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    db["alex.habits"].insert_many(_make_habits(habits, random.Random(seed)))
+    # otherwise first run replays schedules since 2021
+    db["alex.habits_anchors"].insert_many(
+        [{"name": f"habit-{i:05d}", "date": start} for i in range(habits)]
+    )
+
+    client, bot = _CountingClient(mongo_client), _FakeBot()
+    job = HabitsJob(mongo_client=client, bot=bot, is_explain=is_explain)
+    durations, sweep_matched, sweep_examined, sweep_modified = [], 0, 0, 0
+    tracemalloc.start()
+    now = start
+    while (now := now + timedelta(minutes=step_min)) <= start + timedelta(days=days):
+        start_time = time.perf_counter()
+        await job.run(now=now)
+        durations.append(time.perf_counter() - start_time)
+        sweep_matched += job.last_sweep_stats["matched"]
+        if sweep_examined is not None:
+            examined = job.last_sweep_stats["examined"]
+            sweep_examined = None if examined is None else sweep_examined + examined
+        sweep_modified += job.last_sweep_stats["modified"]
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "habits": habits,
+        "runs": len(durations),
+        "punches": db["alex.habitspunch2"].count_documents({}),
+        "failed_punches": db["alex.habitspunch2"].count_documents({"status": "FAILED"}),
+        "sweep_matched": sweep_matched,
+        # needs `--explain` and `--mongo-url`
+        "sweep_examined": sweep_examined,
+        "sweep_modified": sweep_modified,
+        "messages": bot.messages,
+        "message_bytes": bot.bytes,
+        "mongo_ops": dict(sorted(client.counter.items())),
+        "wall_sec": sum(durations),
+        "avg_run_sec": sum(durations) / len(durations) if durations else None,
+        "max_run_sec": max(durations, default=None),
+        "peak_memory_mb": peak_bytes / 2**20,
+    }
+
+
+@click.command()
+@click.option("-n", "--habits", type=int, default=1000, show_default=True)
+@click.option("-d", "--days", type=float, default=1.0, show_default=True)
+@click.option(
+    "--step-min",
+    type=int,
+    default=10,
+    show_default=True,
+    help="interval between job runs (virtual minutes)",
+)
+@click.option("--seed", type=int, default=42, show_default=True)
+@click.option("--mongo-url", help="local `mongod` (default: `mongomock`)")
+@click.option(
+    "--explain/--no-explain",
+    "is_explain",
+    default=False,
+    help="report docs examined by the sweep (needs `--mongo-url`)",
+)
+@click.option("--debug/--no-debug", default=False)
+def habits_benchmark(habits, days, step_min, seed, mongo_url, is_explain, debug):
+    logging.basicConfig(level=logging.INFO if debug else logging.WARNING)
+    if mongo_url is None:
+        import mongomock
+
+        mongo_client = mongomock.MongoClient(tz_aware=False)
+    else:
+        from pymongo import MongoClient
+
+        if not mongo_url.startswith(_LOCAL_URL_PREFIXES):
+            raise click.BadParameter(
+                "refusing to drop collections of non-local Mongo",
+                param_hint="--mongo-url",
+            )
+        mongo_client = MongoClient(mongo_url)
+
+    stats = asyncio.run(
+        _simulate(mongo_client, habits, days, step_min, seed, is_explain)
+    )
+    for k, v in stats.items():
+        if isinstance(v, dict):
+            click.echo(f"{k}:")
+            for kk, vv in v.items():
+                click.echo(f"  {kk}: {vv}")
+        else:
+            click.echo(f"{k}: {v:.3f}" if isinstance(v, float) else f"{k}: {v}")
+
+
+if __name__ == "__main__":
+    habits_benchmark()
@@ -1,32 +1,48 @@
 # heartbeat.py
 import os
 import logging
+import time
 from datetime import datetime
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Updater
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
 from pymongo import MongoClient
 import pandas as pd
 from telegram.error import TimedOut
 
 # Assuming your _common file is now in a 'common' package
-from common import get_sleeping_state, MONGO_COLL_NAME, TIME_CATS, to_utc_datetime
+from common import (
+    get_current_state,
+    get_sleeping_state,
+    update_current_state,
+    MONGO_COLL_NAME,
+    TIME_CATS,
+    to_utc_datetime,
+)
+from common.indexes import get_docs_examined
+from common.time_report import invalidate_day_stats
 
 
 class HeartbeatJob:
-    def __init__(self):
+    def __init__(self, mongo_client=None, bot=None, is_explain=False):
+        """
+        `is_explain` adds docs examined by imputation to its stats (costs a query)
+        """
         # Configuration is now read from environment variables
-        self._token = os.environ["TELEGRAM_TOKEN"]
         self._chat_id = os.environ["CHAT_ID"]
-        self._mongo_url = os.environ["MONGO_URL"]
 
-        # Set up clients
-        self._bot = Updater(self._token, use_context=True).bot
-        self._mongo_client = MongoClient(self._mongo_url)
+        # Set up clients (unless shared ones are given, see `scheduled_jobs.py`)
+        if bot is None:
+            bot = Bot(token=os.environ["TELEGRAM_TOKEN"])
+        if mongo_client is None:
+            mongo_client = MongoClient(os.environ["MONGO_URL"])
+        self._bot = bot
+        self._mongo_client = mongo_client
         self._logger = logging.getLogger(self.__class__.__name__)
         self._keyboard = TIME_CATS
         self._columns = 2
+        self._is_explain = is_explain
+        self.last_imputation_stats = None
 
-    def run(self):
+    async def run(self, lease=None):
         """The main logic of the job."""
         _now = datetime.now()
         self._logger.info(f"Heartbeat job running at {_now.isoformat()}")
@@ -34,33 +50,41 @@ class HeartbeatJob:
         sleeping_state = get_sleeping_state(self._mongo_client)
         self._logger.info(f"Sleeping state: {sleeping_state}")
 
+        if lease is not None:
+            # fencing: do not send keyboard if other instance took over
+            lease.assert_held()
         message_id = "FAILURE"
         try:
             if sleeping_state is None:
-                mess = self._send_keyboard("北鼻，你在幹什麼？")
+                mess = await self._send_keyboard("北鼻，你在幹什麼？")
                 message_id = mess.message_id
             else:
                 is_no_bother, cat = sleeping_state
                 if not is_no_bother:
-                    self._send_message(f"Current state: {cat}")
+                    await self._send_message(f"Current state: {cat}")
         except TimedOut as e:
             self._logger.error(f"Telegram timed out: {e}")
 
-        self._sanitize_mongo(
-            imputation_state="useless" if sleeping_state is None else sleeping_state[1]
+        self.last_imputation_stats = self._sanitize_mongo(
+            imputation_state="useless" if sleeping_state is None else sleeping_state[1],
+            now=_now,
         )
 
         # Log the event to MongoDB
+        time_slot = {
+            "date": _now,
+            "category": None,
+            "telegram_message_id": message_id,
+        }
         res = self._mongo_client[MONGO_COLL_NAME]["alex.time"].insert_one(
-            {
-                "date": _now,
-                "category": None,
-                "telegram_message_id": message_id,
-            }
+            dict(time_slot)
         )
         self._logger.info(f"Inserted record ID: {res.inserted_id}")
+        update_current_state(
+            self._mongo_client, {"$set": {"last_time_slot": time_slot}}
+        )
 
-    def _send_keyboard(self, text):
+    async def _send_keyboard(self, text):
         keyboard = [
             [
                 InlineKeyboardButton(self._keyboard[i + j], callback_data=str(i + j))
@@ -69,22 +93,34 @@ class HeartbeatJob:
             ]
             for i in range(0, len(self._keyboard), self._columns)
         ]
-        return self._bot.send_message(
+        return await self._bot.send_message(
             chat_id=self._chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
         )
 
-    def _send_message(self, text):
-        return self._bot.send_message(chat_id=self._chat_id, text=text)
+    async def _send_message(self, text):
+        return await self._bot.send_message(chat_id=self._chat_id, text=text)
 
-    def _sanitize_mongo(self, imputation_state):
+    def _sanitize_mongo(self, imputation_state, now) -> dict:
+        """
+        imputes unanswered slots logged since the previous run (its high-water mark
+        is kept in current state document), so cost does not grow with `alex.time`
+        """
+        start_time = time.perf_counter()
         self._logger.info(f"Sanitizing with imputation state: {imputation_state}")
         mongo_coll = self._mongo_client[MONGO_COLL_NAME]["alex.time"]
 
-        # Use update_many for efficiency
+        hwm = get_current_state(self._mongo_client, use_cache=False).get(
+            "time_imputation_hwm"
+        )
+        # no mark yet: one-time full pass
+        query = {"category": None}
+        if hwm is not None:
+            query["date"] = {"$gte": hwm}
+        examined = get_docs_examined(mongo_coll, query) if self._is_explain else None
         result = mongo_coll.update_many(
-            {"category": None},
+            query,
             {
                 "$set": {
                     "category": imputation_state,
@@ -92,5 +128,20 @@ class HeartbeatJob:
                 },
             },
         )
+        if result.modified_count > 0:
+            invalidate_day_stats(self._mongo_client, hwm, now)
+        update_current_state(
+            self._mongo_client, {"$set": {"time_imputation_hwm": now}}
+        )
+        stats = {
+            "since": hwm,
+            "matched": result.matched_count,
+            # `totalDocsExamined` (only with `is_explain`)
+            "examined": examined,
+            "modified": result.modified_count,
+            "elapsed_sec": time.perf_counter() - start_time,
+        }
         if result.modified_count > 0:
             self._logger.info(f"Sanitized {result.modified_count} records.")
+        self._logger.info(f"imputation: {stats}")
+        return stats
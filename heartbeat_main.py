@@ -0,0 +1,59 @@
+# heartbeat_main.py
+"""
+single ASGI app for heartbeat-time and heartbeat-habits triggers
+
+run: uvicorn heartbeat_main:app --port 8080
+trigger: POST /heartbeat-time, POST /heartbeat-habits
+"""
+import logging
+import typing
+import contextlib
+from fastapi import FastAPI, Response
+
+from scheduled_jobs import JobRunner
+
+logging.basicConfig(level=logging.INFO)
+
+
+def make_app(default_job: typing.Optional[str] = None) -> FastAPI:
+    """
+    `default_job` is also served at `POST /` (for existing trigger URLs)
+    """
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # clients live as long as the app, on the app's event loop
+        app.state.runner = JobRunner()
+        await app.state.runner.ensure_indexes()
+        yield
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post("/{job_name}")
+    async def trigger(job_name: str):
+        runner = app.state.runner
+        if job_name not in runner.job_names:
+            return Response(content=f"Unknown job {job_name}", status_code=404)
+        logging.info(f"Trigger received, starting {job_name} job.")
+        try:
+            is_run = await runner.run(job_name)
+        except Exception as e:
+            logging.error(f"Job failed: {e}", exc_info=True)
+            return Response(content="Job execution failed", status_code=500)
+        # overlapping trigger is acknowledged, so that it is not retried
+        return "OK" if is_run else "Skipped: already running"
+
+    if default_job is not None:
+
+        @app.post("/")
+        async def trigger_default():
+            return await trigger(default_job)
+
+    @app.get("/metrics")
+    async def metrics():
+        return app.state.runner.metrics
+
+    return app
+
+
+app = make_app()
@@ -0,0 +1,116 @@
+# money_report_benchmark.py
+"""
+`/money report` latency vs number of `alex.money` records: report from rollups
+(`common.money.get_money_report`) and, for comparison, totals computed from
+the raw records of the month; without indexes (`mongomock`) the former still
+scans `alex.money_rollups`, whose size is bounded by days, not by records
+
+run: python3 money_report_benchmark.py --sizes 1000,10000,100000
+
+uses `mongomock` (`pip install -r requirements-dev.txt`) by default, or a local
+stand-in `mongod` given by `--mongo-url` (its `logistics` money collections are dropped!)
+"""
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import click
+
+import common
+from common.money import (
+    MONEY_COLL_NAME,
+    MONEY_ROLLUPS_COLL_NAME,
+    MoneyRecord,
+    get_money_report,
+    insert_money_records,
+)
+
+_CATEGORIES = ["food", "fun", "transport", "rent", "health"]
+_TAGS = ["coffee", "lunch", "taxi", "book", "gift", "pharmacy"]
+_MONTH = "2026-01"
+_LOCAL_URL_PREFIXES = ("mongodb://localhost", "mongodb://127.0.0.1")
+
+
+def _make_records(n: int, rng: random.Random) -> list:
+    # spread over 2 years, i.e. the reported month holds ~1/24 of records
+    start = datetime(2025, 1, 1)
+    return [
+        MoneyRecord(
+            amount=float(rng.randint(1, 500)),
+            category=rng.choice(_CATEGORIES),
+            tags=tuple(sorted(set(rng.sample(_TAGS, rng.randint(0, 2))))),
+            date=start + timedelta(minutes=rng.randrange(2 * 365 * 24 * 60)),
+            comment=f"record #{i}",
+        )
+        for i in range(n)
+    ]
+
+
+def _report_from_records(mongo_client, month: str) -> dict:
+    start = datetime.strptime(month, "%Y-%m")
+    end = (start + timedelta(days=32)).replace(day=1)
+    totals = {}
+    for r in mongo_client[common.MONGO_COLL_NAME][MONEY_COLL_NAME].find(
+        {
+            "date": {
+                "$gte": common.to_utc_datetime(start),
+                "$lt": common.to_utc_datetime(end),
+            }
+        }
+    ):
+        totals[r["category"]] = totals.get(r["category"], 0) + r["amount"]
+    return totals
+
+
+def _median_sec(fn, repeats: int) -> float:
+    durations = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start_time)
+    return statistics.median(durations)
+
+
+@click.command()
+@click.option("--sizes", default="1000,10000,100000", show_default=True)
+@click.option("--repeats", type=int, default=20, show_default=True)
+@click.option("--seed", type=int, default=42, show_default=True)
+@click.option("--mongo-url", help="local `mongod` (default: `mongomock`)")
+def money_report_benchmark(sizes, repeats, seed, mongo_url):
+    if mongo_url is None:
+        import mongomock
+
+        mongo_client = mongomock.MongoClient(tz_aware=False)
+    else:
+        from pymongo import MongoClient
+
+        if not mongo_url.startswith(_LOCAL_URL_PREFIXES):
+            raise click.BadParameter(
+                "refusing to drop collections of non-local Mongo",
+                param_hint="--mongo-url",
+            )
+        mongo_client = MongoClient(mongo_url)
+    db = mongo_client[common.MONGO_COLL_NAME]
+    db[MONEY_COLL_NAME].drop()
+    db[MONEY_ROLLUPS_COLL_NAME].drop()
+
+    rng = random.Random(seed)
+    click.echo(f"{'records':>10} {'rollups ms':>11} {'raw scan ms':>12}")
+    n = 0
+    for size in sorted(map(int, sizes.split(","))):
+        # grow the collection incrementally (rollups are updated on the way);
+        # upserts by content hash are quadratic in `mongomock`, hence no dedup
+        insert_money_records(_make_records(size - n, rng), mongo_client, is_dedup=False)
+        n = size
+        rollups_sec = _median_sec(
+            lambda: get_money_report(mongo_client, _MONTH), repeats
+        )
+        raw_sec = _median_sec(
+            lambda: _report_from_records(mongo_client, _MONTH), repeats
+        )
+        click.echo(f"{n:>10} {rollups_sec * 1e3:>11.2f} {raw_sec * 1e3:>12.2f}")
+
+
+if __name__ == "__main__":
+    money_report_benchmark()
@@ -0,0 +1,110 @@
+# periods_benchmark.py
+"""
+`common.consecutive_periods`/`common.fill_gaps` (int64 arrays) vs their streaming
+variants `iter_consecutive_periods`/`iter_fill_gaps` (fed by a generator, as by a
+Mongo cursor): time and peak traced memory over synthetic heartbeat timestamps
+
+run: python3 periods_benchmark.py --sizes 10000,100000,1000000,10000000
+"""
+import time
+import tracemalloc
+from datetime import timedelta
+
+import click
+import numpy as np
+import pandas as pd
+
+import common
+
+_TD = timedelta(minutes=30)
+
+
+def _make_wall_us(n: int, gap_rate: float, seed: int) -> np.ndarray:
+    """
+    `n` sorted 30-minute slots (with some jitter), where a fraction `gap_rate` of
+    steps skips a few slots
+    """
+    rng = np.random.default_rng(seed)
+    td_us = common._td_us(_TD)
+    steps = np.where(
+        rng.random(n) < gap_rate, rng.integers(2, 6, n), np.ones(n, dtype=np.int64)
+    )
+    start_us = pd.Timestamp("2020-01-01").value // 1000
+    jitter_us = rng.integers(0, 60 * 10**6, n)
+    return start_us + np.cumsum(steps) * td_us + jitter_us
+
+
+def _iter_dates(wall_us: np.ndarray, chunk: int = 100_000):
+    # like a cursor: datetimes are materialized one batch at a time
+    for i in range(0, len(wall_us), chunk):
+        yield from wall_us[i : i + chunk].astype("datetime64[us]").tolist()
+
+
+def _measure(fn, is_memory: bool) -> tuple:
+    if is_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    res = fn()
+    duration_sec = time.perf_counter() - start_time
+    peak_mb = None
+    if is_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return res, duration_sec, peak_mb
+
+
+@click.command()
+@click.option("--sizes", default="10000,100000,1000000,10000000", show_default=True)
+@click.option(
+    "--streaming-max",
+    type=int,
+    default=1_000_000,
+    show_default=True,
+    help="largest size to run streaming variants on (pure Python, slower)",
+)
+@click.option("--gap-rate", type=float, default=0.05, show_default=True)
+@click.option("--seed", type=int, default=42, show_default=True)
+@click.option(
+    "--memory/--no-memory",
+    "is_memory",
+    default=True,
+    help="trace peak memory (slows streaming variants down)",
+)
+def periods_benchmark(sizes, streaming_max, gap_rate, seed, is_memory):
+    click.echo(
+        f"{'timestamps':>11} {'function':>26} {'sec':>8} {'peak mb':>8} {'results':>9}"
+    )
+    for n in sorted(map(int, sizes.split(","))):
+        wall_us = _make_wall_us(n, gap_rate, seed)
+        dates = pd.DatetimeIndex(wall_us.astype("datetime64[us]"))
+        candidates = [
+            ("consecutive_periods", lambda: common.consecutive_periods(dates, _TD)),
+            ("fill_gaps", lambda: common.fill_gaps(dates, _TD)),
+        ]
+        if n <= streaming_max:
+            candidates += [
+                (
+                    "iter_consecutive_periods",
+                    lambda: sum(
+                        1
+                        for _ in common.iter_consecutive_periods(
+                            _iter_dates(wall_us), _TD
+                        )
+                    ),
+                ),
+                (
+                    "iter_fill_gaps",
+                    lambda: sum(
+                        1 for _ in common.iter_fill_gaps(_iter_dates(wall_us), _TD)
+                    ),
+                ),
+            ]
+        for name, fn in candidates:
+            res, duration_sec, peak_mb = _measure(fn, is_memory)
+            count = res if isinstance(res, int) else len(res)
+            peak = "" if peak_mb is None else f"{peak_mb:.1f}"
+            click.echo(f"{n:>11} {name:>26} {duration_sec:>8.3f} {peak:>8} {count:>9}")
+
+
+if __name__ == "__main__":
+    periods_benchmark()
@@ -0,0 +1,122 @@
+# scheduled_jobs.py
+import os
+import logging
+import time
+import typing
+from datetime import datetime
+import asyncio
+from pymongo import MongoClient
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from heartbeat import HeartbeatJob
+from habits import HabitsJob
+from common import MONGO_COLL_NAME
+from common.indexes import ensure_indexes
+from common.lease import acquire_lease
+
+# job name -> crontab line (used by the in-process scheduler only)
+JOB_SCHEDULES = {
+    "heartbeat-time": os.environ.get("HEARTBEAT_TIME_CRON", "*/30 * * * *"),
+    "heartbeat-habits": os.environ.get("HEARTBEAT_HABITS_CRON", "*/10 * * * *"),
+}
+
+
+class JobRunner:
+    """
+    hosts `HeartbeatJob` and `HabitsJob` with shared Mongo and Telegram clients,
+    keeps per-job run-time metrics and does not let runs of the same job overlap
+    (neither within the process, nor across instances, see `common.lease`);
+    should be created from within the running event loop
+    """
+
+    def __init__(self, mongo_client=None, bot=None):
+        if mongo_client is None:
+            mongo_client = MongoClient(os.environ["MONGO_URL"])
+        if bot is None:
+            bot = Bot(
+                token=os.environ["TELEGRAM_TOKEN"],
+                request=HTTPXRequest(http_version="1.1", connection_pool_size=10),
+            )
+        self.mongo_client = mongo_client
+        self.bot = bot
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._jobs = {
+            "heartbeat-time": HeartbeatJob(mongo_client=mongo_client, bot=bot),
+            "heartbeat-habits": HabitsJob(mongo_client=mongo_client, bot=bot),
+        }
+        self.metrics = {
+            name: {
+                "runs": 0,
+                "failures": 0,
+                "skipped": 0,
+                "lease_rejected": 0,
+                "last_lease_wait_sec": None,
+                "last_lease_hold_sec": None,
+                "last_started_at": None,
+                "last_duration_sec": None,
+                "max_duration_sec": 0.0,
+                "total_duration_sec": 0.0,
+                "last_error": None,
+            }
+            for name in self._jobs
+        }
+        self._locks = {name: asyncio.Lock() for name in self._jobs}
+
+    async def ensure_indexes(self) -> None:
+        """
+        creates missing indexes (see `common.indexes`) on the jobs' database; a
+        failure is logged and does not keep the app from starting
+        """
+        try:
+            names = await asyncio.to_thread(
+                ensure_indexes, self.mongo_client, [MONGO_COLL_NAME]
+            )
+            self._logger.info(f"ensured {len(names)} indexes")
+        except Exception as e:
+            self._logger.error(f"cannot ensure indexes: {e}", exc_info=True)
+
+    @property
+    def job_names(self) -> typing.List[str]:
+        return list(self._jobs)
+
+    async def run(self, name: str) -> bool:
+        """
+        returns False if the job was skipped, because its previous run is still going
+        (here or on other instance)
+        """
+        metrics = self.metrics[name]
+        if self._locks[name].locked():
+            metrics["skipped"] += 1
+            self._logger.warning(f"{name} is already running, skipping")
+            return False
+
+        async with self._locks[name]:
+            start_time = time.perf_counter()
+            lease = acquire_lease(self.mongo_client, name)
+            metrics["last_lease_wait_sec"] = time.perf_counter() - start_time
+            if lease is None:
+                metrics["lease_rejected"] += 1
+                self._logger.warning(f"{name} is leased by other instance, skipping")
+                return False
+
+            metrics["last_started_at"] = datetime.now().isoformat()
+            try:
+                await self._jobs[name].run(lease=lease)
+                metrics["last_error"] = None
+            except Exception as e:
+                metrics["failures"] += 1
+                metrics["last_error"] = repr(e)
+                raise
+            finally:
+                lease.release()
+                metrics["last_lease_hold_sec"] = lease.hold_sec
+                duration_sec = time.perf_counter() - start_time
+                metrics["runs"] += 1
+                metrics["last_duration_sec"] = duration_sec
+                metrics["max_duration_sec"] = max(
+                    metrics["max_duration_sec"], duration_sec
+                )
+                metrics["total_duration_sec"] += duration_sec
+                self._logger.info(f"{name}: {metrics}")
+        return True
@@ -0,0 +1,56 @@
+# scheduler_main.py
+"""
+long-running alternative to Cloud Scheduler triggers of `heartbeat_time_main.py`
+and `heartbeat_habits_main.py`: runs both jobs in one process, on one event loop
+
+run: uvicorn scheduler_main:app --port 8080
+(needs an always-on instance, e.g. Cloud Run with `--no-cpu-throttling --min-instances=1`)
+"""
+import logging
+import contextlib
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from fastapi import FastAPI
+
+from scheduled_jobs import JobRunner, JOB_SCHEDULES
+from common import TARGET_TIMEZONE
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+async def _run_job(runner: JobRunner, name: str) -> None:
+    try:
+        await runner.run(name)
+    except Exception as e:
+        logging.error(f"Job {name} failed: {e}", exc_info=True)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    runner = JobRunner()
+    await runner.ensure_indexes()
+    scheduler = AsyncIOScheduler(timezone=TARGET_TIMEZONE)
+    for name in runner.job_names:
+        scheduler.add_job(
+            _run_job,
+            CronTrigger.from_crontab(JOB_SCHEDULES[name], timezone=TARGET_TIMEZONE),
+            args=[runner, name],
+            id=name,
+            # skipped (not queued) if previous run is still going
+            max_instances=1,
+            coalesce=True,
+        )
+    scheduler.start()
+    app.state.runner = runner
+    yield
+    scheduler.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/metrics")
+async def metrics():
+    return app.state.runner.metrics
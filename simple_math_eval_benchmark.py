@@ -0,0 +1,73 @@
+# simple_math_eval_benchmark.py
+"""
+throughput and memory of `common.simple_math_eval.simple_math_eval` over many
+evaluations (memory should stay flat once the compiled-expression cache is full)
+
+run: python3 simple_math_eval_benchmark.py --evaluations 1000000
+"""
+import gc
+import logging
+import sys
+import time
+import tracemalloc
+
+import click
+
+from common.simple_math_eval import _compile, simple_math_eval
+
+
+def _make_exprs(n: int) -> list:
+    return [f"{i}+{i % 7}*(3.5-{i % 13})/2" for i in range(n)]
+
+
+@click.command()
+@click.option("-n", "--evaluations", type=int, default=1_000_000, show_default=True)
+@click.option(
+    "--distinct",
+    type=int,
+    default=5000,
+    show_default=True,
+    help="distinct expressions (more than cache size means cache misses)",
+)
+@click.option("--every", type=int, default=100_000, help="report every N evaluations")
+@click.option(
+    "--tracemalloc/--no-tracemalloc",
+    "is_tracemalloc",
+    default=False,
+    help="also report traced memory (several times slower)",
+)
+def simple_math_eval_benchmark(evaluations, distinct, every, is_tracemalloc):
+    exprs = _make_exprs(distinct)
+    handlers_before = sum(
+        len(logger.handlers)
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    )
+    if is_tracemalloc:
+        tracemalloc.start()
+    click.echo(
+        f"{'evaluations':>12} {'usec/eval':>10} {'blocks':>10} {'traced kb':>10} {'cache':>6}"
+    )
+    start_time = last_time = time.perf_counter()
+    last_i = 0
+    for i in range(1, evaluations + 1):
+        simple_math_eval(exprs[i % distinct])
+        if i % every == 0 or i == evaluations:
+            now = time.perf_counter()
+            gc.collect()
+            traced = tracemalloc.get_traced_memory()[0] / 2**10 if is_tracemalloc else 0
+            click.echo(
+                f"{i:>12} {(now - last_time) / (i - last_i) * 1e6:>10.2f} {sys.getallocatedblocks():>10} {traced:>10.1f} {_compile.cache_info().currsize:>6}"
+            )
+            last_time, last_i = time.perf_counter(), i
+    handlers_after = sum(
+        len(logger.handlers)
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    )
+    click.echo(f"total: {time.perf_counter() - start_time:.1f} sec")
+    click.echo(f"logging handlers: {handlers_before} -> {handlers_after}")
+
+
+if __name__ == "__main__":
+    simple_math_eval_benchmark()
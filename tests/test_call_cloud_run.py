@@ -0,0 +1,112 @@
+import asyncio
+import socket
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+uvicorn = pytest.importorskip("uvicorn")
+# `_actor_exp` needs the toolbox (installed from git in the deployed images)
+pytest.importorskip("alex_leontiev_toolbox_python")
+
+import _actor_exp
+import common
+
+
+@pytest.fixture(scope="module")
+def dummy_url():
+    """
+    `dummy_cloud_run_target` served on a free local port
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(
+            "dummy_cloud_run_target:app", port=port, log_level="warning", lifespan="off"
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/"
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def mongo_client(dummy_url):
+    mongo_client = mongomock.MongoClient(tz_aware=False)
+    mongo_client["logistics"][_actor_exp._CALL_CLOUD_RUN_CONFIG_COLL].insert_many(
+        [
+            {"name": "dummy", "url": dummy_url},
+            {"name": "dummy-short", "url": dummy_url, "timeout_sec": 0.5},
+        ]
+    )
+    return mongo_client
+
+
+def _call(text: str, mongo_client) -> list:
+    """
+    runs `/call text` and waits for its background job; returns messages sent
+    """
+    messages = []
+
+    async def send_message_cb(text, **kwargs):
+        messages.append(text)
+
+    async def _run():
+        await _actor_exp.call_cloud_run(text, send_message_cb, mongo_client)
+        await asyncio.gather(*_actor_exp._CALL_CLOUD_RUN_TASKS)
+
+    asyncio.run(_run())
+    return messages
+
+
+def _jobs_coll(mongo_client):
+    return mongo_client["logistics"][_actor_exp._CALL_CLOUD_RUN_JOBS_COLL]
+
+
+@pytest.mark.parametrize(
+    "text,status",
+    [("dummy 0.1", "success"), ("dummy 0.1 fail", "failure")],
+)
+def test_job_lifecycle(mongo_client, text, status):
+    messages = _call(text, mongo_client)
+    (job,) = _jobs_coll(mongo_client).find()
+    assert job["status"] == status
+    assert job["end_date"] >= job["start_date"]
+    assert messages[0] == f"called `dummy` as job `{job['job_id']}`"
+    assert f"finished with status {status}" in messages[1]
+
+
+def test_job_timeout(mongo_client):
+    _call("dummy-short 3", mongo_client)
+    (job,) = _jobs_coll(mongo_client).find()
+    assert job["status"] == "failure"
+    assert job["duration_sec"] < 3
+
+
+def test_stale_jobs(mongo_client):
+    jobs_coll = _jobs_coll(mongo_client)
+    start_date = common.to_utc_datetime() - timedelta(hours=1)
+    jobs_coll.insert_one(
+        {
+            "job_id": "deadbeef",
+            "function": "dummy",
+            "status": "running",
+            "start_date": start_date,
+            "deadline": start_date + timedelta(minutes=1),
+        }
+    )
+    # shown as stale, but status read does not write
+    (message,) = _call("status deadbeef", mongo_client)
+    assert "`deadbeef` `dummy` stale" in message
+    assert jobs_coll.find_one({"job_id": "deadbeef"})["status"] == "running"
+
+    # swept when next job starts
+    _call("dummy 0", mongo_client)
+    assert jobs_coll.find_one({"job_id": "deadbeef"})["status"] == "stale"
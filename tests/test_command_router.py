@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from common.command_router import (
+    CommandRouter,
+    default_middlewares,
+    interactive_middlewares,
+)
+
+
+class _FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, text, chat_id, **kwargs):
+        self.messages.append(text)
+
+
+@pytest.fixture
+def router():
+    router = CommandRouter(
+        resources={"bot": _FakeBot()}, middlewares=default_middlewares()
+    )
+    calls = []
+
+    async def echo(args, send_message_cb):
+        calls.append(args)
+        await send_message_cb(args)
+
+    async def fail(args):
+        raise RuntimeError(args)
+
+    router.add("/echo", echo, aliases=["/e"])
+    router.add("/fail", fail)
+    router.add("/ask", echo, middlewares=interactive_middlewares())
+    router.add("/ask_fail", fail, middlewares=interactive_middlewares())
+    router.calls = calls
+    return router
+
+
+def _dispatch(router, text: str, **extra) -> bool:
+    return asyncio.run(router.dispatch(1, text, **extra))
+
+
+def test_resolve(router):
+    assert router.resolve("/e@somebot  a\nb") == ("/echo", "a\nb")
+    assert router.resolve("/echo") == ("/echo", "")
+    assert router.resolve("/unknown x") is None
+
+
+def test_middlewares_are_opt_in(router):
+    # re-deliveries are not dropped and errors propagate by default
+    for _ in range(2):
+        assert _dispatch(router, "/echo x", message_id=7)
+    assert router.calls == ["x", "x"]
+    with pytest.raises(RuntimeError):
+        _dispatch(router, "/fail x")
+    assert router.metrics["/fail"]["errors"] == 1
+
+
+def test_interactive_middlewares(router):
+    for _ in range(2):
+        _dispatch(router, "/ask y", message_id=8)
+    assert router.calls == ["y"]
+    _dispatch(router, "/ask_fail z")
+    assert router.get_resource("bot").messages == [
+        "y",
+        "/ask_fail failed: RuntimeError('z')",
+    ]
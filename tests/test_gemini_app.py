@@ -0,0 +1,220 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+telegram = pytest.importorskip("telegram")
+
+import app
+
+
+class _FakeBot:
+    def __init__(self):
+        # message_id -> current text
+        self.messages = {}
+        # calls to fail with `RetryAfter` before succeeding
+        self.flood_waits = 0
+
+    def _maybe_flood(self):
+        if self.flood_waits > 0:
+            self.flood_waits -= 1
+            raise telegram.error.RetryAfter(0)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._maybe_flood()
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = text
+        return SimpleNamespace(message_id=message_id)
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self._maybe_flood()
+        self.messages[message_id] = text
+
+
+class _CountingModel(app.FakeGenerativeModel):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await super().generate_content_async(contents, stream, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture(autouse=True)
+def bot(monkeypatch):
+    bot = _FakeBot()
+    monkeypatch.setattr(app, "bot", bot)
+    monkeypatch.setattr(
+        app, "gemini_model", _CountingModel(latency_sec=0.01, latency_per_token_sec=0)
+    )
+    monkeypatch.setattr(app, "GEMINI_METRICS", dict(app.GEMINI_METRICS))
+    # semaphore is bound to the loop of the first `asyncio.run`
+    monkeypatch.setattr(app, "_gemini_semaphore", None)
+    monkeypatch.setattr(app, "prompt_cache", None)
+    monkeypatch.setattr(app, "conversation_memory", None)
+    monkeypatch.setattr(app, "GEMINI_STREAMING", False)
+    return bot
+
+
+def _gather(*coros) -> list:
+    async def _run():
+        return await asyncio.gather(*coros)
+
+    return asyncio.run(_run())
+
+
+def test_concurrency_is_bounded(monkeypatch):
+    monkeypatch.setattr(app, "GEMINI_MAX_CONCURRENCY", 2)
+    texts = _gather(*[app.generate_reply(f"prompt {i}") for i in range(6)])
+    assert texts == [f"(fake) prompt {i}" for i in range(6)]
+    assert app.gemini_model.max_in_flight == 2
+    assert app.GEMINI_METRICS["requests"] == 6
+    assert app.GEMINI_METRICS["max_queue_wait_sec"] > 0
+    assert app.GEMINI_METRICS["in_flight"] == app.GEMINI_METRICS["waiting"] == 0
+
+
+def test_timeout_releases_slot(monkeypatch):
+    monkeypatch.setattr(app, "GEMINI_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(app, "GEMINI_TIMEOUT_SEC", 0.05)
+    monkeypatch.setattr(app, "gemini_model", app.FakeGenerativeModel(latency_sec=1))
+
+    async def _run():
+        with pytest.raises(asyncio.TimeoutError):
+            await app.generate_reply("slow")
+        app.gemini_model = app.FakeGenerativeModel(latency_sec=0)
+        return await app.generate_reply("fast")
+
+    assert asyncio.run(_run()) == "(fake) fast"
+    assert app.GEMINI_METRICS["timeouts"] == 1
+    assert app.GEMINI_METRICS["in_flight"] == 0
+
+
+def test_stream_spills_over_message_limit(monkeypatch, bot):
+    monkeypatch.setattr(app, "TELEGRAM_MESSAGE_LIMIT", 10)
+    monkeypatch.setattr(app, "GEMINI_STREAM_EDIT_INTERVAL_SEC", 0)
+    text = "0123456789abcdefghijklmnopqrstuvwxyz"
+    writer = app._StreamWriter(chat_id=1)
+
+    async def _run():
+        for chunk in [text[:7], text[7:20], text[20:]]:
+            await writer.append(chunk)
+        await writer.flush()
+
+    asyncio.run(_run())
+    assert writer.text == text
+    assert list(bot.messages.values()) == [text[i : i + 10] for i in range(0, 36, 10)]
+
+
+def test_stream_flood_control(monkeypatch, bot):
+    monkeypatch.setattr(app, "GEMINI_STREAM_EDIT_INTERVAL_SEC", 0)
+    writer = app._StreamWriter(chat_id=1)
+
+    async def _run():
+        # first message is retried
+        bot.flood_waits = 1
+        await writer.append("hello")
+        assert bot.messages == {1: "hello"}
+        # intermediate edit is skipped, final one is retried
+        bot.flood_waits = 1
+        await writer.append(" world")
+        assert bot.messages == {1: "hello"}
+        bot.flood_waits = 1
+        await writer.flush()
+
+    asyncio.run(_run())
+    assert bot.messages == {1: "hello world"}
+    assert app.GEMINI_METRICS["flood_waits"] == 3
+
+
+def test_stream_reply(monkeypatch, bot):
+    monkeypatch.setattr(app, "GEMINI_STREAM_EDIT_INTERVAL_SEC", 0)
+    (text,) = _gather(app.stream_reply(1, "a b c"))
+    assert text == "(fake) a b c"
+    assert bot.messages == {1: text}
+    assert app.GEMINI_METRICS["last_ttft_sec"] is not None
+
+
+def test_prompt_cache_lru():
+    cache = app.PromptCache(max_bytes=10, ttl_sec=60)
+
+    async def _run():
+        await cache.put("a", "12345", 1.0)
+        await cache.put("b", "12345", 1.0)
+        assert await cache.get("a") == ("12345", 1.0)
+        await cache.put("c", "12345", 1.0)
+        # larger than the whole cache
+        await cache.put("d", "12345678901", 1.0)
+        return [await cache.get(k) for k in "abcd"]
+
+    assert asyncio.run(_run()) == [("12345", 1.0), None, ("12345", 1.0), None]
+    assert (len(cache), cache.bytes) == (2, 10)
+    assert app.GEMINI_METRICS["cache_evictions"] == 1
+
+
+def test_prompt_cache_ttl():
+    cache = app.PromptCache(max_bytes=10, ttl_sec=-1)
+
+    async def _run():
+        await cache.put("a", "12345", 1.0)
+        return await cache.get("a")
+
+    assert asyncio.run(_run()) is None
+    assert (len(cache), cache.bytes) == (0, 0)
+
+
+def test_reply_from_cache(monkeypatch, bot):
+    monkeypatch.setattr(app, "prompt_cache", app.PromptCache(2**20, 60))
+    for prompt in ["Tell me a joke", "tell me  a joke!", "what time is it"]:
+        _gather(app.reply(1, prompt))
+    assert list(bot.messages.values()) == [
+        "(fake) Tell me a joke",
+        "(fake) Tell me a joke",
+        "(fake) what time is it",
+    ]
+    metrics = app.GEMINI_METRICS
+    assert (metrics["cache_hits"], metrics["cache_misses"]) == (1, 1)
+    assert metrics["cache_bypassed"] == 1
+
+
+def test_conversation_memory_stays_within_budget():
+    memory = app.ConversationMemory(token_budget=100)
+
+    async def _run():
+        state = await memory.load(1)
+        assert memory.contents(state, "hi") == "hi"
+        for i in range(10):
+            await memory.append(1, state, f"question {i} " * 5, f"answer {i} " * 5)
+        return state
+
+    state = asyncio.run(_run())
+    assert app.GEMINI_METRICS["memory_summarizations"] > 0
+    assert app.estimate_tokens(state["summary"]) <= 25
+    contents = memory.contents(state, "next")
+    assert contents[0]["parts"][0].startswith("Summary of our conversation so far:")
+    assert [c["role"] for c in contents[2:]] == ["user", "model"] * (
+        (len(contents) - 3) // 2
+    ) + ["user"]
+    assert contents[-1] == {"role": "user", "parts": ["next"]}
+    assert app.estimate_tokens(contents[2:-1]) <= 75
+
+
+def test_turns_of_chat_are_serialized(monkeypatch):
+    memory = app.ConversationMemory(token_budget=1000)
+    monkeypatch.setattr(app, "conversation_memory", memory)
+    _gather(app.reply(1, "a"), app.reply(1, "b"), app.reply(2, "c"))
+    state = asyncio.run(memory.load(1))
+    # second turn saw the first one
+    assert state["turns"] == [
+        ["user", "a"],
+        ["model", "(fake) a"],
+        ["user", "b"],
+        ["model", "(fake) b"],
+    ]
+    assert app._chat_locks == {}
@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+import pytz
+
+mongomock = pytest.importorskip("mongomock")
+
+from common import MONGO_COLL_NAME, TARGET_TIMEZONE
+from habits import HabitsJob, _expand_occurrences, set_habit_cronline
+
+_TZ = pytz.timezone(TARGET_TIMEZONE)
+
+
+def _local(*args) -> datetime:
+    return _TZ.localize(datetime(*args)).astimezone(pytz.utc)
+
+
+class _FakeBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        pass
+
+
+@pytest.fixture
+def mongo_client():
+    return mongomock.MongoClient(tz_aware=False)
+
+
+def _habits_coll(mongo_client):
+    return mongo_client[MONGO_COLL_NAME]["alex.habits"]
+
+
+def _run(mongo_client, now: datetime) -> None:
+    job = HabitsJob(mongo_client=mongo_client, bot=_FakeBot())
+    asyncio.run(job.run(now=now))
+
+
+def _punch_dates(mongo_client) -> list:
+    return sorted(
+        pytz.utc.localize(p["date"])
+        for p in mongo_client[MONGO_COLL_NAME]["alex.habitspunch2"].find()
+    )
+
+
+def test_expand_occurrences():
+    occurrences, next_occurrence = _expand_occurrences(
+        "0 9 * * *", datetime(2026, 1, 1, 9), datetime(2026, 1, 3, 12), True
+    )
+    assert occurrences == [datetime(2026, 1, d, 9) for d in (1, 2, 3)]
+    assert next_occurrence == datetime(2026, 1, 4, 9)
+
+
+@pytest.fixture
+def habit(mongo_client, monkeypatch):
+    monkeypatch.setenv("CHAT_ID", "0")
+    _habits_coll(mongo_client).insert_one(
+        {"name": "h", "cronline": "0 9 * * *", "enabled": True}
+    )
+    # otherwise punches are created since 2021
+    mongo_client[MONGO_COLL_NAME]["alex.habits_anchors"].insert_one(
+        {"name": "h", "date": _local(2026, 1, 1, 10)}
+    )
+    # schedules the habit: next due is tomorrow at 9:00
+    _run(mongo_client, _local(2026, 1, 1, 12))
+    assert _habits_coll(mongo_client).find_one()["next_due"] == _local(
+        2026, 1, 2, 9
+    ).replace(tzinfo=None)
+    return "h"
+
+
+def test_set_habit_cronline(mongo_client, habit):
+    next_due = set_habit_cronline(
+        mongo_client, habit, "0 21 * * *", now=_local(2026, 1, 1, 13)
+    )
+    assert next_due == _local(2026, 1, 1, 21)
+    _run(mongo_client, _local(2026, 1, 2, 22))
+    assert _punch_dates(mongo_client)[-2:] == [
+        _local(2026, 1, 1, 21),
+        _local(2026, 1, 2, 21),
+    ]
+    assert _local(2026, 1, 2, 9) not in _punch_dates(mongo_client)
+
+
+def test_set_habit_cronline_overdue(mongo_client, habit):
+    # job did not run since old `next_due`
+    next_due = set_habit_cronline(
+        mongo_client, habit, "0 21 * * *", now=_local(2026, 1, 3, 12)
+    )
+    assert next_due == _local(2026, 1, 2, 21)
+
+
+def test_set_habit_cronline_invalid(mongo_client, habit):
+    with pytest.raises(ValueError):
+        set_habit_cronline(mongo_client, habit, "not a cronline")
+    with pytest.raises(KeyError):
+        set_habit_cronline(mongo_client, "missing", "0 9 * * *")
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+mongomock = pytest.importorskip("mongomock")
+
+import common
+from common import hook_dispatch
+from common.hook_dispatch import (
+    DEAD_LETTER,
+    DEAD_LETTERS_COLL_NAME,
+    DISPATCHED,
+    REJECTED,
+    UNKNOWN,
+    HookDispatcher,
+)
+
+_URL = "http://localhost:8080/hook"
+
+
+def _http_error(status_code: int) -> requests.exceptions.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(f"{status_code}", response=response)
+
+
+class _FakeTarget:
+    """
+    `post_to_hook` failing with (or sleeping for) the given outcomes in turn
+    """
+
+    def __init__(self, *outcomes):
+        self._outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, url, payload, timeout=None) -> int:
+        outcome = self._outcomes[min(self.calls, len(self._outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        time.sleep(outcome)
+        return 200
+
+
+@pytest.fixture
+def mongo_client():
+    return mongomock.MongoClient(tz_aware=False)
+
+
+def _dispatch(mongo_client, monkeypatch, target: _FakeTarget) -> tuple:
+    """
+    returns outcome, metrics and duration (not waiting for the losing attempt)
+    """
+    monkeypatch.setattr(hook_dispatch, "post_to_hook", target)
+    dispatcher = HookDispatcher(mongo_client, hedge_after_sec=0.1)
+
+    async def _run():
+        start_time = time.perf_counter()
+        outcome = await dispatcher.dispatch(_URL, {}, idempotent=True)
+        return outcome, time.perf_counter() - start_time
+
+    outcome, duration_sec = asyncio.run(_run())
+    return outcome, dispatcher.metrics, duration_sec
+
+
+@pytest.mark.parametrize(
+    "error,outcome",
+    [
+        (_http_error(400), REJECTED),
+        (_http_error(502), UNKNOWN),
+        (_http_error(504), UNKNOWN),
+        (requests.exceptions.ReadTimeout(), UNKNOWN),
+    ],
+)
+def test_no_retry_unless_replayable(mongo_client, monkeypatch, error, outcome):
+    target = _FakeTarget(error, 0)
+    assert _dispatch(mongo_client, monkeypatch, target)[0] == outcome
+    assert target.calls == 1
+    dead_letters = mongo_client[common.MONGO_COLL_NAME][DEAD_LETTERS_COLL_NAME]
+    assert dead_letters.count_documents({}) == (outcome != REJECTED)
+
+
+@pytest.mark.parametrize(
+    "error", [_http_error(503), requests.exceptions.ConnectionError()]
+)
+def test_retry_if_replayable(mongo_client, monkeypatch, error):
+    target = _FakeTarget(error, 0)
+    outcome, metrics, _ = _dispatch(mongo_client, monkeypatch, target)
+    assert (outcome, target.calls, metrics["retries"]) == (DISPATCHED, 2, 1)
+
+    target = _FakeTarget(error)
+    assert _dispatch(mongo_client, monkeypatch, target)[0] == DEAD_LETTER
+
+
+def test_hedge(mongo_client, monkeypatch):
+    target = _FakeTarget(0.5, 0)
+    outcome, metrics, duration_sec = _dispatch(mongo_client, monkeypatch, target)
+    assert (outcome, target.calls, metrics["hedges"]) == (DISPATCHED, 2, 1)
+    assert duration_sec < 0.5
+
+
+def test_hedge_stops_at_rejection(mongo_client, monkeypatch):
+    target = _FakeTarget(0.5, _http_error(400))
+    outcome, _, duration_sec = _dispatch(mongo_client, monkeypatch, target)
+    assert outcome == REJECTED
+    assert duration_sec < 0.5
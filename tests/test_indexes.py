@@ -0,0 +1,63 @@
+import os
+
+import pymongo
+import pytest
+
+from common import indexes
+
+# local stand-in `mongod`; its `test_*` databases are dropped
+_MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL", "mongodb://localhost:27017")
+
+
+def _get_mongod_client():
+    client = pymongo.MongoClient(_MONGO_TEST_URL, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"no mongod at {_MONGO_TEST_URL}")
+    return client
+
+
+@pytest.fixture
+def test_registry(monkeypatch):
+    """
+    registry with every database renamed to `test_<database>`
+    """
+    monkeypatch.setattr(
+        indexes,
+        "INDEXES",
+        [s._replace(database=f"test_{s.database}") for s in indexes.INDEXES],
+    )
+    monkeypatch.setattr(
+        indexes,
+        "HOT_QUERIES",
+        [q._replace(database=f"test_{q.database}") for q in indexes.HOT_QUERIES],
+    )
+    return {s.database for s in indexes.INDEXES}
+
+
+def test_ensure_indexes_mongomock(test_registry):
+    mongomock = pytest.importorskip("mongomock")
+    mongo_client = mongomock.MongoClient()
+    names = indexes.ensure_indexes(mongo_client)
+    assert len(names) == len(indexes.INDEXES)
+    # idempotent
+    assert indexes.ensure_indexes(mongo_client) == names
+
+
+def test_hot_queries_use_indexes(test_registry):
+    mongo_client = _get_mongod_client()
+    for database in test_registry:
+        mongo_client.drop_database(database)
+    try:
+        names = indexes.ensure_indexes(mongo_client)
+        assert indexes.ensure_indexes(mongo_client) == names
+        # non-empty collections, otherwise the winning plan is `EOF`
+        for database, collection in {
+            (q.database, q.collection) for q in indexes.HOT_QUERIES
+        }:
+            mongo_client[database][collection].insert_one({"_filler": True})
+        assert indexes.check_hot_queries(mongo_client) == []
+    finally:
+        for database in test_registry:
+            mongo_client.drop_database(database)
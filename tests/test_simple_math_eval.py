@@ -0,0 +1,63 @@
+import gc
+import logging
+import sys
+
+import pytest
+
+from common.simple_math_eval import _compile, simple_math_eval
+
+
+@pytest.mark.parametrize(
+    "s,expected",
+    [
+        ("2+3*5", 17),
+        ("(2+3)*5", 25),
+        ("10-4-3", 3),
+        ("100/10/5", 2),
+        ("-3+5", 2),
+        ("2*-3", -6),
+        ("-(1+2)*3", -9),
+        ("123+456", 579),
+        ("1.5*2", 3),
+        (".5+.25", 0.75),
+        ("3.+1", 4),
+        (" 1 + 2 * ( 3 - 1 ) ", 5),
+    ],
+)
+def test_simple_math_eval(s, expected):
+    assert simple_math_eval(s) == pytest.approx(expected)
+
+
+def test_number_utils():
+    assert simple_math_eval("7/2", number_utils=(int, int)) == 3
+
+
+@pytest.mark.parametrize("s", ["", "abc", "1+", "(1+2", "1+2)", "*3", "1 2"])
+def test_malformed(s):
+    with pytest.raises(ValueError):
+        simple_math_eval(s)
+
+
+def _count_handlers() -> int:
+    return sum(
+        len(logger.handlers)
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    )
+
+
+# run with `python -m pytest -m slow`
+@pytest.mark.slow
+def test_flat_memory_over_million_evaluations():
+    exprs = [f"{i}+{i % 7}*(3.5-{i % 13})/2" for i in range(5000)]
+    handlers = _count_handlers()
+    blocks = []
+    for i in range(1_000_000):
+        simple_math_eval(exprs[i % len(exprs)])
+        if i + 1 in (100_000, 1_000_000):
+            gc.collect()
+            blocks.append(sys.getallocatedblocks())
+    assert _compile.cache_info().currsize <= _compile.cache_info().maxsize
+    assert _count_handlers() == handlers
+    # cache is full after the first 100k, nothing should accumulate afterwards
+    assert blocks[1] - blocks[0] < 100
@@ -1,5 +1,8 @@
 # time_react.py (now with dispatcher logic)
 import os
+import functools
+import importlib
+import inspect
 import logging
 import requests  # Make sure 'requests' is in your requirements.txt
 import telegram
@@ -8,6 +11,15 @@ from pymongo import MongoClient
 from datetime import datetime
 import typing
 import common  # Assuming your common module is accessible
+import common.hook_dispatch
+import common.time_report
+from common.command_router import CommandRouter, default_middlewares
+from common.hook_dispatch import (
+    Bulkhead,
+    BulkheadFullError,
+    HookDispatcher,
+    get_id_token,
+)
 
 # --- Configuration ---
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_TOKEN")
@@ -15,6 +27,22 @@ MONGO_URL = os.environ.get("MONGO_URL")
 CHAT_ID = os.environ.get("CHAT_ID")
 # --- NEW: URL for the private service that will handle other commands ---
 ACTOR_SERVER_URL = os.environ.get("ACTOR_SERVER_URL")
+# combined mode: comma-separated actor server modules (e.g. `actor_server`), whose
+# `COMMANDS` are served in-process, without a hop to their Cloud Run services
+COMBINED_ACTOR_SERVERS = os.environ.get("COMBINED_ACTOR_SERVERS", "")
+# hooks with `url` like `local://_actor.add_note` are called in-process
+LOCAL_HOOK_SCHEME = "local://"
+# modules local hooks may come from (hooks documents are data, not code to trust)
+LOCAL_HOOK_MODULES = os.environ.get("LOCAL_HOOK_MODULES", "_actor,_actor_exp")
+HOOK_TIMEOUT_SEC = float(os.environ.get("HOOK_TIMEOUT_SEC", "30"))
+# second attempt for hooks with `"idempotent": true`, if first is slower than that
+# (helps with cold starts only, see `common.hook_dispatch.HookDispatcher`)
+HOOK_HEDGE_AFTER_SEC = float(os.environ.get("HOOK_HEDGE_AFTER_SEC", "3"))
+# cap on commands in flight (all routes together); per-hook caps are set by
+# `max_concurrency` field of `cloud-run-hooks-gcp` documents
+HOOK_MAX_CONCURRENCY = int(os.environ.get("HOOK_MAX_CONCURRENCY", "32"))
+# over the cap, webhook answers 503 and Telegram redelivers the update later
+HOOK_RETRY_AFTER_SEC = float(os.environ.get("HOOK_RETRY_AFTER_SEC", "5"))
 
 # --- Initialization ---
 logging.basicConfig(
@@ -27,19 +55,42 @@ bot = telegram.Bot(token=TELEGRAM_BOT_TOKEN) if TELEGRAM_BOT_TOKEN else None
 # Initialize MongoDB Client
 mongo_client = MongoClient(MONGO_URL) if MONGO_URL else None
 
+# in-process commands: combined actor servers by command name, local hooks by url
+local_router = CommandRouter(
+    resources={"bot": bot, "mongo_client": mongo_client},
+    middlewares=default_middlewares(),
+)
+for module_name in filter(None, map(str.strip, COMBINED_ACTOR_SERVERS.split(","))):
+    local_router.add_commands(importlib.import_module(module_name).COMMANDS)
+    logging.info(f"serving commands of {module_name} in-process")
 
-# --- NEW: Dispatcher function ---
-def get_id_token(audience_url: str) -> typing.Optional[str]:
-    """Fetches a Google-signed ID token for the given audience URL."""
-    token_url = f"http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/identity?audience={audience_url}"
-    token_headers = {"Metadata-Flavor": "Google"}
-    try:
-        token_response = requests.get(token_url, headers=token_headers)
-        token_response.raise_for_status()
-        return token_response.text
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to fetch ID token: {e}")
-        return None
+
+@functools.lru_cache(maxsize=None)
+def _get_local_hook(url: str) -> str:
+    """
+    imports handler of `local://<module>.<function>`, registers it under `url`
+    """
+    module_name, _, function_name = url.removeprefix(LOCAL_HOOK_SCHEME).rpartition(".")
+    if module_name not in set(map(str.strip, LOCAL_HOOK_MODULES.split(","))):
+        raise ValueError(f"module of {url} is not in `{LOCAL_HOOK_MODULES}`")
+    handler = getattr(importlib.import_module(module_name), function_name)
+    # actor commands only: not private helpers, nor names imported into the module
+    if (
+        function_name.startswith("_")
+        or not inspect.iscoroutinefunction(handler)
+        or handler.__module__ != module_name
+    ):
+        raise ValueError(f"{url} is not an actor command")
+    local_router.add(url, handler)
+    return url
+
+
+# remote hooks: circuit breaker per url, hedging and dead letters
+hook_dispatcher = HookDispatcher(
+    mongo_client, timeout_sec=HOOK_TIMEOUT_SEC, hedge_after_sec=HOOK_HEDGE_AFTER_SEC
+)
+# shared by remote hooks, local hooks and combined actor servers
+bulkhead = Bulkhead(HOOK_MAX_CONCURRENCY, retry_after_sec=HOOK_RETRY_AFTER_SEC)
 
 
 # --- Webhook Endpoint ---
@@ -91,6 +142,12 @@ async def telegram_webhook(request: Request):
                     }
                 },
             )
+            common.update_current_state(
+                mongo_client,
+                {"$set": {"last_time_slot.category": time_category}},
+                condition={"last_time_slot.telegram_message_id": message_id},
+            )
+            common.time_report.invalidate_day_stats(mongo_client, msg["date"])
             await bot.delete_message(chat_id, message_id)
             await bot.send_message(chat_id=chat_id, text=f"Got: {time_category}")
         else:
@@ -101,7 +158,15 @@ async def telegram_webhook(request: Request):
     # --- NEW: Else, dispatch it to a generic actor server ---
     # 2. For any other message type, forward it to the private actor server.
     else:
-        await process_message(update_json)
+        try:
+            await process_message(update_json)
+        except BulkheadFullError as e:
+            logging.warning(f"{e}, asking Telegram to redeliver")
+            return Response(
+                content="Too many requests in flight",
+                status_code=503,
+                headers={"Retry-After": str(round(e.retry_after_sec))},
+            )
 
     return "OK"
 
@@ -153,6 +218,8 @@ async def process_message(update_json: dict) -> None:
     """
     Processes incoming messages, matching prefixes from MongoDB to dispatch
     to the appropriate Cloud Run service.
+
+    Raises `BulkheadFullError` (before calling anything) if the target is busy.
     """
     if not mongo_client:
         logging.error("Mongo client not configured. Cannot process message.")
@@ -175,11 +242,25 @@ async def process_message(update_json: dict) -> None:
     message_text = message_text.strip()
     logging.debug(f"message: {message_text}")
 
+    # combined mode
+    resolved = local_router.resolve(message_text)
+    if resolved is not None:
+        name, args = resolved
+        with bulkhead.acquire(name):
+            await local_router.call(
+                name, chat_id, message_text, args, message_id=message.get("message_id")
+            )
+        return
+
     # 2. Fetch routing rules from MongoDB
     try:
         hooks_coll = mongo_client["logistics"]["cloud-run-hooks-gcp"]
         # Fetch all hooks at once
-        hooks = list(hooks_coll.find({}, {"prefix": 1, "url": 1}))
+        hooks = list(
+            hooks_coll.find(
+                {}, {"prefix": 1, "url": 1, "idempotent": 1, "max_concurrency": 1}
+            )
+        )
         if not hooks:
             logging.warning("No routing hooks found in MongoDB.")
             await handle_no_match(update_json)
@@ -229,34 +310,57 @@ async def process_message(update_json: dict) -> None:
             await handle_no_match(update_json)  # Fallback if URL is missing
             return
 
-        logging.info(
-            f"Dispatching message starting with '{best_match_hook.get('prefix')}' to {target_url}..."
-        )
-        id_token = get_id_token(target_url)
-        if not id_token:
-            # Error already logged by get_id_token
-            # Optionally send an error message back to the user
-            # await bot.send_message(chat_id=chat_id, text="Error obtaining authentication token.")
+        prefix = best_match_hook["prefix"]
+        max_concurrency = best_match_hook.get("max_concurrency")
+        if target_url.startswith(LOCAL_HOOK_SCHEME):
+            logging.info(f"Calling '{prefix}' hook {target_url} in-process...")
+            try:
+                name = _get_local_hook(target_url)
+            except (ImportError, AttributeError, ValueError, AssertionError) as e:
+                logging.error(f"Cannot load local hook {target_url}: {e}")
+                await handle_no_match(update_json)
+                return
+            with bulkhead.acquire(prefix, max_concurrency):
+                await local_router.call(
+                    name,
+                    chat_id,
+                    message_text,
+                    message_text.removeprefix(prefix).strip(),
+                    message_id=message.get("message_id"),
+                )
             return
 
-        headers = {"Authorization": f"Bearer {id_token}"}
-        try:
-            # Forward the entire original Telegram update payload
-            response = requests.post(target_url, headers=headers, json=update_json)
-            response.raise_for_status()  # Check for HTTP errors from the target service
-            logging.info(
-                f"Successfully dispatched to {target_url}. Status: {response.status_code}"
+        logging.info(f"Dispatching message starting with '{prefix}' to {target_url}...")
+        with bulkhead.acquire(prefix, max_concurrency):
+            outcome = await hook_dispatcher.dispatch(
+                target_url,
+                update_json,
+                idempotent=best_match_hook.get("idempotent", False),
+            )
+        if outcome != common.hook_dispatch.DISPATCHED and bot:
+            await bot.send_message(
+                chat_id=chat_id,
+                text={
+                    common.hook_dispatch.DEAD_LETTER: f"`{prefix}` is unavailable now, the command is saved for replay",
+                    common.hook_dispatch.UNKNOWN: f"`{prefix}` did not answer in time, the command may still complete",
+                    common.hook_dispatch.REJECTED: f"`{prefix}` rejected the command",
+                }[outcome],
             )
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error calling target service {target_url}: {e}")
-            # Optionally send an error message back to the user
-            # await bot.send_message(chat_id=chat_id, text="There was an error processing your command.")
     else:
         # No prefix matched
         logging.info(f"No matching prefix found for message: '{message_text}'")
         await handle_no_match(update_json)
 
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "hooks": hook_dispatcher.get_metrics(),
+        "bulkhead": bulkhead.get_metrics(),
+        "local": local_router.metrics,
+    }
+
+
 def get_help(hooks: list[dict]) -> str:
     ## FIXME: change to DEBUG once stable
     logging.info(hooks)